@@ -1,21 +1,48 @@
 import os
+import asyncio
 import logging
+import multiprocessing
+import queue
+import random
+import re
+import threading
+import time
+import base64
+import hashlib
+import itertools
+import json
+import struct
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email.utils import parsedate_to_datetime
+from contextlib import contextmanager
 from typing import List, Optional
 import glob
+import tempfile
+from datetime import datetime
 import tiktoken
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-from docling.chunking import HybridChunker
-from docling.document_converter import DocumentConverter
+# Google Drive and Docling are only needed for ingestion, which runs in worker.py; they are imported
+# where used so the chat-serving workers never load them.
+import numpy as np
 from dotenv import load_dotenv
-from openai import OpenAI
+import openai
+from openai import OpenAI, AsyncOpenAI
 import psycopg2
-from psycopg2.extras import execute_values
+import psycopg2.extensions
+from psycopg2.extras import execute_values, Json
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from auth import get_current_user
+from metrics import (
+    DB_POOL_IN_USE, DB_POOL_MAX, DB_POOL_TIMEOUTS, DB_POOL_WAIT_SECONDS, MetricsMiddleware,
+    observe_stage, record_tokens, stage_timer, timed
+)
 
 # --- Setup ---
 load_dotenv()
@@ -29,6 +56,7 @@ logger = logging.getLogger(__name__)
 
 # --- OpenAI Configuration ---
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))  # Used by the streaming endpoint
 
 # --- Tokenizer ---
 class OpenAITokenizerWrapper:
@@ -52,12 +80,66 @@ class OpenAITokenizerWrapper:
 tokenizer = OpenAITokenizerWrapper()
 MAX_TOKENS = 8191
 EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_DIMENSIONS = 3072
 CHAT_MODEL = "gpt-3.5-turbo"  # Accessible model
+chat_tokenizer = OpenAITokenizerWrapper(CHAT_MODEL)
+
+# --- Context Assembly Configuration ---
+# Upper bound on prompt tokens (system + question + context) sent with each completion.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# Retrieved chunks this similar (Jaccard over word 3-grams) to a better-ranked one are dropped.
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.9"))
+CONTEXT_MIN_PASSAGE_TOKENS = 100  # Don't bother truncating a passage below this
+
+# --- Embedding Engine Configuration ---
+# OpenAI caps an embeddings request at 2048 inputs and 300k tokens; stay below both.
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "250000"))
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "512"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))  # Batches in flight per embed_text call
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_BACKOFF_BASE = float(os.getenv("EMBED_BACKOFF_BASE", "1"))  # Seconds, doubled on every retry
+EMBED_BACKOFF_MAX = float(os.getenv("EMBED_BACKOFF_MAX", "60"))
+# Query embeddings arriving within this window are sent as one request; 0 sends each on its own.
+QUERY_EMBED_BATCH_WINDOW = float(os.getenv("QUERY_EMBED_BATCH_WINDOW_MS", "5")) / 1000
+QUERY_EMBED_BATCH_MAX = int(os.getenv("QUERY_EMBED_BATCH_MAX", "64"))
+
+# --- Cache Configuration ---
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))  # Seconds
+# Optional second tier in Postgres so embeddings survive restarts and are shared between workers.
+QUERY_EMBEDDING_CACHE_PERSIST = os.getenv("QUERY_EMBEDDING_CACHE_PERSIST", "false").lower() == "true"
+QUERY_EMBEDDING_CACHE_PERSIST_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_PERSIST_TTL", str(7 * 24 * 3600)))
+# Opt-in: answers are reused for new questions within ANSWER_CACHE_MAX_DISTANCE (cosine) of an already
+# answered one. Questions that differ by a single qualifier ("during pregnancy" / "after childbirth") can
+# sit within 0.05 of each other and would get each other's answer, so keep the distance tight; a larger
+# one saves more completions at the cost of answering a different question.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # Seconds
+ANSWER_CACHE_MAX_DISTANCE = float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.015"))
+CORPUS_VERSION_CHECK_INTERVAL = float(os.getenv("CORPUS_VERSION_CHECK_INTERVAL", "1"))  # Seconds
+
+# --- Ingestion Pipeline Configuration ---
+INGEST_DOWNLOAD_WORKERS = int(os.getenv("INGEST_DOWNLOAD_WORKERS", "4"))  # Parallel Drive downloads
+# Each conversion process holds its own copy of the Docling models (1-2 GB), so the default is one;
+# raise it on hosts with memory to spare. Not derived from os.cpu_count(), which sees the host's CPUs in a container.
+INGEST_CONVERT_PROCESSES = int(os.getenv("INGEST_CONVERT_PROCESSES", "1"))
+# Conversion processes are shut down after this many seconds without a job. 0 keeps them running.
+INGEST_CONVERT_IDLE_TIMEOUT = float(os.getenv("INGEST_CONVERT_IDLE_TIMEOUT", "600"))
+INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", "4"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))  # Files allowed to wait between two stages
+INGEST_STORE_BATCH_SIZE = int(os.getenv("INGEST_STORE_BATCH_SIZE", "5"))  # Files per database write
 
 # --- Google Drive Configuration ---
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 CREDENTIALS_FILE = '/app/credentials.json'
 DEFAULT_GOOGLE_DRIVE_FOLDER_ID = os.getenv('GOOGLE_DRIVE_FOLDER_ID')
+# Point at a local fake Drive (see fakes.py) for testing, e.g. http://localhost:8765/drive/v3/
+GOOGLE_DRIVE_API_ENDPOINT = os.getenv('GOOGLE_DRIVE_API_ENDPOINT')
+GOOGLE_DRIVE_RECURSIVE = os.getenv('GOOGLE_DRIVE_RECURSIVE', 'true').lower() == 'true'  # Descend into subfolders
+GOOGLE_DRIVE_PAGE_SIZE = 1000
+GOOGLE_DRIVE_DOWNLOAD_CHUNK_SIZE = 10 * 1024 * 1024
+GOOGLE_DRIVE_FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
 
 # --- PostgreSQL Configuration ---
 DB_PARAMS = {
@@ -67,6 +149,46 @@ DB_PARAMS = {
     "host": os.getenv("POSTGRES_HOST", "postgres"),
     "port": os.getenv("POSTGRES_PORT", "5432")
 }
+# Postgres runs with max_connections=20, so keep the per-worker pool small.
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # Seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTHCHECK_INTERVAL", "30"))  # Ping connections idle longer than this
+
+# --- Vector Index Configuration ---
+# pgvector cannot index VECTOR(3072) directly, so ANN search goes through an expression index on a
+# half-precision ("halfvec") or binary-quantized ("binary") copy, then re-ranks on the full vector.
+ANN_MODE = os.getenv("ANN_MODE", "exact")  # exact | halfvec | binary
+ANN_INDEX_TYPE = os.getenv("ANN_INDEX_TYPE", "hnsw")  # hnsw | ivfflat
+ANN_CANDIDATES = int(os.getenv("ANN_CANDIDATES", "100"))  # Rows fetched from the index before exact re-ranking
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "100"))
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "100"))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+ANN_MAINTENANCE_WORK_MEM = os.getenv("ANN_MAINTENANCE_WORK_MEM", "256MB")
+if ANN_MODE not in ("exact", "halfvec", "binary"):
+    raise ValueError(f"Invalid ANN_MODE '{ANN_MODE}'. Use exact, halfvec or binary.")
+if ANN_INDEX_TYPE not in ("hnsw", "ivfflat"):
+    raise ValueError(f"Invalid ANN_INDEX_TYPE '{ANN_INDEX_TYPE}'. Use hnsw or ivfflat.")
+
+# --- Hybrid Search Configuration ---
+# "hybrid" fuses full-text and vector candidates with reciprocal rank fusion (RRF).
+# chunks.tsv and its index are only set up (by the worker) when SEARCH_MODE=hybrid.
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector")  # vector | hybrid
+TEXT_SEARCH_CONFIG = os.getenv("TEXT_SEARCH_CONFIG", "english")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))  # Candidates taken from each retriever
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+HYBRID_TEXT_WEIGHT = float(os.getenv("HYBRID_TEXT_WEIGHT", "1.0"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+if SEARCH_MODE not in ("vector", "hybrid"):
+    raise ValueError(f"Invalid SEARCH_MODE '{SEARCH_MODE}'. Use vector or hybrid.")
+if not re.fullmatch(r"[a-z_]+", TEXT_SEARCH_CONFIG):
+    raise ValueError(f"Invalid TEXT_SEARCH_CONFIG '{TEXT_SEARCH_CONFIG}'.")
+
+# --- Batch Query Configuration ---
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "500"))  # Queries accepted per /chat/batch or /search/batch call
+BATCH_COMPLETION_CONCURRENCY = int(os.getenv("BATCH_COMPLETION_CONCURRENCY", "8"))  # Completions in flight per batch
 
 # --- FastAPI Setup ---
 app = FastAPI(title="Cerince RAG API")
@@ -76,278 +198,2001 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # --- Google Drive Functions ---
-def authenticate_google_drive():
-    logger.info("Authenticating with Google Drive using service account...")
-    credentials = service_account.Credentials.from_service_account_file(
-        CREDENTIALS_FILE, scopes=SCOPES
-    )
-    return build('drive', 'v3', credentials=credentials)
-
-def list_gdrive_files(folder_id):
-    service = authenticate_google_drive()
-    query = f"'{folder_id}' in parents"
-    results = service.files().list(q=query, fields="files(id, name, mimeType)").execute()
-    return results.get('files', [])
-
-def download_gdrive_file(file_id, file_name, mime_type):
-    service = authenticate_google_drive()
-    os.makedirs("/tmp", exist_ok=True)
-    request = None
+_drive_credentials = None
+_drive_credentials_lock = threading.Lock()
+# Discovery clients wrap an httplib2.Http, which is not thread-safe, so each thread keeps its own.
+_drive_services = threading.local()
+
+def get_drive_credentials():
+    global _drive_credentials
+    with _drive_credentials_lock:
+        if _drive_credentials is None:
+            if GOOGLE_DRIVE_API_ENDPOINT:
+                from google.auth.credentials import AnonymousCredentials
+                logger.info(f"Using Google Drive API at {GOOGLE_DRIVE_API_ENDPOINT} without credentials.")
+                _drive_credentials = AnonymousCredentials()
+            else:
+                from google.oauth2 import service_account
+                logger.info("Authenticating with Google Drive using service account...")
+                _drive_credentials = service_account.Credentials.from_service_account_file(
+                    CREDENTIALS_FILE, scopes=SCOPES
+                )
+        return _drive_credentials
+
+def get_drive_service():
+    service = getattr(_drive_services, "service", None)
+    if service is None:
+        from googleapiclient.discovery import build
+        client_options = {"api_endpoint": GOOGLE_DRIVE_API_ENDPOINT} if GOOGLE_DRIVE_API_ENDPOINT else None
+        service = build(
+            'drive', 'v3', credentials=get_drive_credentials(),
+            client_options=client_options, cache_discovery=False, static_discovery=True
+        )
+        _drive_services.service = service
+    return service
+
+def list_gdrive_files(folder_id, recursive: bool = GOOGLE_DRIVE_RECURSIVE):
+    """Lists every file under `folder_id`, following all result pages and, if `recursive`, subfolders."""
+    service = get_drive_service()
+    files, seen_files = [], set()
+    pending_folders, seen_folders = [folder_id], {folder_id}
+    while pending_folders:
+        current = pending_folders.pop()
+        page_token = None
+        # Incremental sync deletes documents missing from the listing, so it must not stop at the first page.
+        while True:
+            results = service.files().list(
+                q=f"'{current}' in parents and trashed = false",
+                fields="nextPageToken, files(id, name, mimeType, modifiedTime, md5Checksum)",
+                pageSize=GOOGLE_DRIVE_PAGE_SIZE,
+                pageToken=page_token,
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True
+            ).execute()
+            for file_info in results.get('files', []):
+                if file_info.get('mimeType') != GOOGLE_DRIVE_FOLDER_MIME_TYPE:
+                    # Legacy files can have several parents; list each once, or the same flush upserts it twice.
+                    if file_info['id'] not in seen_files:
+                        seen_files.add(file_info['id'])
+                        files.append(file_info)
+                elif recursive and file_info['id'] not in seen_folders:
+                    seen_folders.add(file_info['id'])
+                    pending_folders.append(file_info['id'])
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+    logger.info(f"Found {len(files)} files in {len(seen_folders)} Google Drive folders.")
+    return files
+
+def download_gdrive_file(file_id, file_name, mime_type, download_dir: str):
+    """Streams a Drive file to download_dir/<file_id>/, so files with the same name never collide."""
+    from googleapiclient.http import MediaIoBaseDownload
+    service = get_drive_service()
+    file_dir = os.path.join(download_dir, file_id)
+    os.makedirs(file_dir, exist_ok=True)
+    safe_name = file_name.replace(os.sep, "_") or file_id
     if mime_type == 'application/vnd.google-apps.document':
         logger.info(f"Exporting Google Doc '{file_name}' as PDF.")
         request = service.files().export_media(fileId=file_id, mimeType='application/pdf')
-        file_path = f"/tmp/{file_name}.pdf" if not file_name.lower().endswith('.pdf') else f"/tmp/{file_name}"
+        file_path = os.path.join(file_dir, safe_name if safe_name.lower().endswith('.pdf') else f"{safe_name}.pdf")
     else:
         logger.info(f"Downloading standard file '{file_name}'.")
-        request = service.files().get_media(fileId=file_id)
-        file_path = f"/tmp/{file_name}"
+        request = service.files().get_media(fileId=file_id, supportsAllDrives=True)
+        file_path = os.path.join(file_dir, safe_name)
     with open(file_path, 'wb') as f:
-        downloader = MediaIoBaseDownload(f, request)
+        downloader = MediaIoBaseDownload(f, request, chunksize=GOOGLE_DRIVE_DOWNLOAD_CHUNK_SIZE)
         done = False
         while not done:
             status, done = downloader.next_chunk()
             logger.debug(f"Download progress for {file_name}: {int(status.progress() * 100)}%.")
     return file_path
 
+# --- PostgreSQL Connection Pool ---
+# Embeddings are float32 arrays; send them like the float lists they replace (e.g. for %s::vector).
+psycopg2.extensions.register_adapter(np.ndarray, lambda array: psycopg2.extensions.adapt(array.tolist()))
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection that remembers which statements it has prepared and when it was last used."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+        self.last_used = time.monotonic()
+
+class DatabasePool:
+    """Thread-safe connection pool shared by the request handlers of one worker."""
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, healthcheck_interval: float, **params):
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._pool = ThreadedConnectionPool(minconn, maxconn, connection_factory=PooledConnection, **params)
+        # ThreadedConnectionPool raises as soon as it is exhausted; the semaphore makes callers queue instead.
+        self._slots = threading.BoundedSemaphore(maxconn)
+        DB_POOL_MAX.inc(maxconn)
+        self._maxconn = maxconn
+
+    def _is_healthy(self, conn: PooledConnection) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _checkout(self) -> PooledConnection:
+        conn = self._pool.getconn()
+        if not self._is_healthy(conn):
+            logger.warning("Discarding broken PostgreSQL connection from pool.")
+            self._pool.putconn(conn, close=True)
+            conn = self._pool.getconn()
+        return conn
+
+    @contextmanager
+    def connection(self):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            DB_POOL_TIMEOUTS.inc()
+            raise PoolError(f"Timed out after {self.timeout}s waiting for a database connection")
+        DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+        DB_POOL_IN_USE.inc()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        finally:
+            if conn is not None:
+                broken = bool(conn.closed)
+                if not broken and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        broken = True
+                conn.last_used = time.monotonic()
+                self._pool.putconn(conn, close=broken)
+            DB_POOL_IN_USE.dec()
+            self._slots.release()
+
+    def close(self):
+        self._pool.closeall()
+        DB_POOL_MAX.dec(self._maxconn)
+
+db_pool: Optional[DatabasePool] = None
+_db_pool_lock = threading.Lock()
+
+def init_db_pool() -> DatabasePool:
+    global db_pool
+    with _db_pool_lock:
+        if db_pool is None:
+            db_pool = DatabasePool(
+                DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_INTERVAL, **DB_PARAMS
+            )
+            logger.info(f"PostgreSQL connection pool ready (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE}).")
+    return db_pool
+
+def close_db_pool():
+    global db_pool
+    with _db_pool_lock:
+        if db_pool is not None:
+            db_pool.close()
+            db_pool = None
+            logger.info("PostgreSQL connection pool closed.")
+
+@contextmanager
+def get_db_connection():
+    # The pool is normally created at startup, but create it lazily if the database was down back then.
+    pool = db_pool or init_db_pool()
+    with pool.connection() as conn:
+        yield conn
+
+def execute_prepared(cursor, name: str, statement: str, params: tuple, placeholders: Optional[str] = None):
+    """Runs `statement` (written with $1, $2... parameters) as a server-side prepared statement."""
+    conn = cursor.connection
+    if name not in conn.prepared_statements:
+        cursor.execute(f"PREPARE {name} AS {statement}")
+        conn.prepared_statements.add(name)
+    placeholders = placeholders or ", ".join(["%s"] * len(params))
+    cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+
 # --- PostgreSQL Functions ---
 def setup_postgres():
-    conn = None
     try:
-        conn = psycopg2.connect(**DB_PARAMS)
-        cursor = conn.cursor()
-        cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS chunks (
-                id SERIAL PRIMARY KEY,
-                doc_id VARCHAR(255),
-                doc_name VARCHAR(255),
-                chunk_index INTEGER,
-                text TEXT,
-                embedding VECTOR(3072),
-                filename VARCHAR(255),
-                page_numbers INTEGER[],
-                title VARCHAR(255),
-                source_type VARCHAR(50),
-                UNIQUE (doc_id, chunk_index, source_type)
-            )
-        """)
-        conn.commit()
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                # API workers and the ingestion worker start together; concurrent CREATE ... IF NOT EXISTS
+                # can still fail with a unique violation, so only one process runs this at a time.
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext('setup_postgres'))")
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS chunks (
+                        id SERIAL PRIMARY KEY,
+                        doc_id VARCHAR(255),
+                        doc_name VARCHAR(255),
+                        chunk_index INTEGER,
+                        text TEXT,
+                        embedding VECTOR({EMBEDDING_DIMENSIONS}),
+                        filename VARCHAR(255),
+                        page_numbers INTEGER[],
+                        title VARCHAR(255),
+                        source_type VARCHAR(50),
+                        UNIQUE (doc_id, chunk_index, source_type)
+                    )
+                """)
+                # sha256 of the chunk text, used to skip re-embedding chunks that did not change.
+                cursor.execute("ALTER TABLE chunks ADD COLUMN IF NOT EXISTS text_hash CHAR(64)")
+                # Last synced version of every source document, so unchanged files can be skipped.
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS documents (
+                        doc_id VARCHAR(255),
+                        source_type VARCHAR(50),
+                        source_root TEXT,
+                        doc_name VARCHAR(255),
+                        modified_marker TEXT,
+                        content_hash TEXT,
+                        chunk_count INTEGER,
+                        synced_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                        PRIMARY KEY (doc_id, source_type)
+                    )
+                """)
+                # /process jobs, claimed and run by worker.py outside the API process.
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS ingest_jobs (
+                        id BIGSERIAL PRIMARY KEY,
+                        status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                        request JSONB NOT NULL,
+                        summary JSONB,
+                        error TEXT,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        worker VARCHAR(255),
+                        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                        started_at TIMESTAMPTZ,
+                        heartbeat_at TIMESTAMPTZ,
+                        finished_at TIMESTAMPTZ
+                    )
+                """)
+                cursor.execute("CREATE INDEX IF NOT EXISTS ingest_jobs_queued_idx ON ingest_jobs (id) WHERE status = 'queued'")
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS ingest_job_files (
+                        job_id BIGINT REFERENCES ingest_jobs (id) ON DELETE CASCADE,
+                        doc_id VARCHAR(255),
+                        doc_name VARCHAR(255),
+                        status VARCHAR(20),
+                        chunks INTEGER,
+                        embedded INTEGER,
+                        seconds DOUBLE PRECISION,
+                        timings JSONB,
+                        error TEXT,
+                        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                        PRIMARY KEY (job_id, doc_id)
+                    )
+                """)
+                # Bumped on every corpus change so caches in any worker can tell their entries are stale.
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS corpus_state (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        version BIGINT NOT NULL DEFAULT 0
+                    )
+                """)
+                cursor.execute("INSERT INTO corpus_state (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING")
+                if QUERY_EMBEDDING_CACHE_PERSIST:
+                    cursor.execute(f"""
+                        CREATE TABLE IF NOT EXISTS query_embedding_cache (
+                            cache_key CHAR(64) PRIMARY KEY,
+                            model VARCHAR(100),
+                            dimensions INTEGER,
+                            embedding VECTOR({EMBEDDING_DIMENSIONS}),
+                            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                        )
+                    """)
+                    cursor.execute(
+                        "DELETE FROM query_embedding_cache WHERE created_at < now() - make_interval(secs => %s)",
+                        (QUERY_EMBEDDING_CACHE_PERSIST_TTL,)
+                    )
+            conn.commit()
         logger.info("PostgreSQL setup complete.")
     except psycopg2.Error as e:
         logger.error(f"PostgreSQL setup error: {e}")
         raise
-    finally:
-        if conn:
-            cursor.close()
-            conn.close()
 
-def embed_text(texts: List[str]) -> List[List[float]]:
+def build_index_concurrently(index_name: str, definition: str, prepare=None):
+    """Creates `index_name` with CREATE INDEX CONCURRENTLY unless a valid one already exists.
+
+    Only the ingestion worker builds indexes, never the API; until an index is valid, queries run
+    without it. CONCURRENTLY lets ingestion keep writing meanwhile, and an advisory lock keeps a
+    second worker from starting (or dropping) the same build. `prepare(cursor)` runs under the
+    lock first, for migrations the index depends on.
+    """
+    with get_db_connection() as conn:
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (index_name,))
+                if not cursor.fetchone()[0]:
+                    logger.info(f"Index {index_name} is being built by another process.")
+                    return
+                try:
+                    if prepare is not None:
+                        prepare(cursor)
+                    cursor.execute(
+                        """
+                        SELECT i.indisvalid, EXISTS (
+                            SELECT 1 FROM pg_stat_progress_create_index p WHERE p.index_relid = i.indexrelid
+                        )
+                        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                        WHERE c.relname = %s
+                        """,
+                        (index_name,)
+                    )
+                    row = cursor.fetchone()
+                    if row and row[0]:
+                        return
+                    if row and row[1]:
+                        # Invalid only because it is still being built, e.g. by hand outside this lock.
+                        logger.info(f"Index {index_name} is already being built.")
+                        return
+                    if row:
+                        logger.warning(f"Dropping invalid index {index_name} left by an interrupted build.")
+                        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+                    logger.info(f"Building index {index_name} on existing chunks...")
+                    cursor.execute("SET maintenance_work_mem = %s", (ANN_MAINTENANCE_WORK_MEM,))
+                    cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON chunks {definition}")
+                    cursor.execute("RESET maintenance_work_mem")
+                    logger.info(f"Index {index_name} ready.")
+                finally:
+                    cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (index_name,))
+        finally:
+            conn.autocommit = False
+
+# Index expression and distance operator class for each ANN mode.
+ANN_INDEX_EXPRESSIONS = {
+    "halfvec": (f"(embedding::halfvec({EMBEDDING_DIMENSIONS}))", "halfvec_cosine_ops"),
+    "binary": (f"(binary_quantize(embedding)::bit({EMBEDDING_DIMENSIONS}))", "bit_hamming_ops"),
+}
+
+def ann_index_name() -> str:
+    return f"chunks_embedding_{ANN_MODE}_{ANN_INDEX_TYPE}_idx"
+
+def ensure_ann_index():
+    """Builds the ANN index for the configured mode, covering any rows already in the table.
+
+    The index is an expression index, so existing rows need no backfill: building it is the migration.
+    """
+    if ANN_INDEX_TYPE == "hnsw":
+        options = f"WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+    else:
+        options = f"WITH (lists = {IVFFLAT_LISTS})"
+    expression, opclass = ANN_INDEX_EXPRESSIONS[ANN_MODE]
+    build_index_concurrently(ann_index_name(), f"USING {ANN_INDEX_TYPE} ({expression} {opclass}) {options}")
+
+TEXT_SEARCH_BACKFILL_BATCH = 1000  # Rows per transaction when filling chunks.tsv for existing rows
+
+def _prepare_text_search(cursor):
+    cursor.execute(
+        "SELECT attgenerated FROM pg_attribute WHERE attrelid = 'chunks'::regclass AND attname = 'tsv' AND NOT attisdropped"
+    )
+    row = cursor.fetchone()
+    if row and row[0]:
+        return  # Stored generated column from an earlier version: already maintained by Postgres.
+    # A plain column filled by a trigger, rather than a generated one: adding it is a catalog change
+    # instead of a table rewrite under an exclusive lock, and existing rows are filled in small batches.
+    cursor.execute("ALTER TABLE chunks ADD COLUMN IF NOT EXISTS tsv tsvector")
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION chunks_tsv_update() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            -- Section titles weigh more than body text.
+            NEW.tsv := setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(NEW.title, '')), 'A') ||
+                       setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(NEW.text, '')), 'B');
+            RETURN NEW;
+        END $$
+    """)
+    cursor.execute("""
+        CREATE OR REPLACE TRIGGER chunks_tsv_trigger BEFORE INSERT OR UPDATE OF text, title ON chunks
+        FOR EACH ROW EXECUTE FUNCTION chunks_tsv_update()
+    """)
+    filled = 0
+    while True:
+        # Rewriting title fires the trigger; each batch commits on its own (autocommit).
+        cursor.execute(
+            "UPDATE chunks SET title = title WHERE id IN (SELECT id FROM chunks WHERE tsv IS NULL LIMIT %s)",
+            (TEXT_SEARCH_BACKFILL_BATCH,)
+        )
+        if cursor.rowcount == 0:
+            break
+        filled += cursor.rowcount
+    if filled:
+        logger.info(f"Filled chunks.tsv for {filled} existing chunks.")
+
+def ensure_text_search_index():
+    """Sets up chunks.tsv and its GIN index, the full-text side of hybrid search."""
+    build_index_concurrently("chunks_tsv_idx", "USING gin (tsv)", prepare=_prepare_text_search)
+
+# --- Embedding Engine ---
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_rate_limit_delay(headers) -> Optional[float]:
+    """Seconds to wait before retrying, according to OpenAI's rate-limit response headers."""
+    if headers is None:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    # x-ratelimit-reset-* use Go-style durations such as "1s", "6m0s" or "20ms".
+    resets = []
+    for name in ("x-ratelimit-reset-tokens", "x-ratelimit-reset-requests"):
+        parts = _DURATION_PART.findall(headers.get(name) or "")
+        if parts:
+            resets.append(sum(float(value) * _DURATION_UNITS[unit] for value, unit in parts))
+    return max(resets) if resets else None
+
+class EmbeddingEngine:
+    """Embeds large lists of texts in token-bounded batches, a few at a time, retrying on rate limits.
+
+    Output order always matches input order.
+    """
+
+    RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+    def __init__(self, client: OpenAI, tokenizer: "OpenAITokenizerWrapper", model: str, dimensions: int,
+                 max_batch_tokens: int, max_batch_items: int, concurrency: int, max_retries: int):
+        # Retries are handled here so they can follow the rate-limit headers.
+        self.client = client.with_options(max_retries=0)
+        self.tokenizer = tokenizer
+        self.model = model
+        self.dimensions = dimensions
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_retries = max_retries
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed")
+        self._stats = {"calls": 0, "requests": 0, "inputs": 0, "tokens": 0, "retries": 0, "truncated": 0, "seconds": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, **counts):
+        with self._stats_lock:
+            for key, value in counts.items():
+                self._stats[key] += value
+
+    def _prepare(self, texts: List[str]):
+        inputs, token_counts, truncated = [], [], 0
+        for text in texts:
+            tokens = self.tokenizer.encode(text)
+            if len(tokens) > MAX_TOKENS:
+                tokens = tokens[:MAX_TOKENS]
+                text = self.tokenizer.decode(tokens)
+                truncated += 1
+            # The API rejects empty strings.
+            inputs.append(text or " ")
+            token_counts.append(max(len(tokens), 1))
+        if truncated:
+            logger.warning(f"Truncated {truncated} inputs to {MAX_TOKENS} tokens before embedding.")
+        return inputs, token_counts, truncated
+
+    def _pack(self, token_counts: List[int]) -> List[tuple]:
+        batches, start, batch_tokens = [], 0, 0
+        for i, count in enumerate(token_counts):
+            if i > start and (batch_tokens + count > self.max_batch_tokens or i - start >= self.max_batch_items):
+                batches.append((start, i))
+                start, batch_tokens = i, 0
+            batch_tokens += count
+        if start < len(token_counts):
+            batches.append((start, len(token_counts)))
+        return batches
+
+    def _request(self, inputs: List[str], estimated_tokens: int) -> List[List[float]]:
+        attempt = 0
+        while True:
+            try:
+                # base64 is the compact wire format and decodes straight into float32 arrays.
+                response = self.client.embeddings.create(
+                    model=self.model, input=inputs, dimensions=self.dimensions, encoding_format="base64"
+                )
+                break
+            except self.RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                response_headers = getattr(getattr(e, "response", None), "headers", None)
+                delay = parse_rate_limit_delay(response_headers)
+                if delay is None:
+                    delay = EMBED_BACKOFF_BASE * (2 ** attempt)
+                delay = min(delay, EMBED_BACKOFF_MAX) + random.uniform(0, EMBED_BACKOFF_BASE)
+                attempt += 1
+                self._record(retries=1)
+                logger.warning(f"Embedding request failed ({type(e).__name__}); retry {attempt}/{self.max_retries} in {delay:.1f}s.")
+                time.sleep(delay)
+        used_tokens = response.usage.total_tokens if response.usage else estimated_tokens
+        self._record(requests=1, inputs=len(inputs), tokens=used_tokens)
+        record_tokens(self.model, embedding=used_tokens)
+        return [
+            np.frombuffer(base64.b64decode(item.embedding), dtype="<f4")
+            for item in sorted(response.data, key=lambda item: item.index)
+        ]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        started = time.monotonic()
+        inputs, token_counts, truncated = self._prepare(texts)
+        batches = self._pack(token_counts)
+        if len(batches) == 1:
+            results = [self._request(inputs, sum(token_counts))]
+        else:
+            futures = [
+                self._executor.submit(self._request, inputs[start:end], sum(token_counts[start:end]))
+                for start, end in batches
+            ]
+            results = [future.result() for future in futures]
+        self._record(calls=1, truncated=truncated, seconds=time.monotonic() - started)
+        return [embedding for batch in results for embedding in batch]
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        seconds = stats["seconds"] or None
+        stats["inputs_per_second"] = round(stats["inputs"] / seconds, 2) if seconds else 0.0
+        stats["tokens_per_second"] = round(stats["tokens"] / seconds, 2) if seconds else 0.0
+        stats["seconds"] = round(stats["seconds"], 3)
+        return stats
+
+embedding_engine = EmbeddingEngine(
+    client, tokenizer, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS,
+    EMBED_BATCH_MAX_TOKENS, EMBED_BATCH_MAX_ITEMS, EMBED_CONCURRENCY, EMBED_MAX_RETRIES
+)
+
+@timed("embed")
+def embed_text(texts: List[str]) -> List[np.ndarray]:
     if not texts:
         return []
     try:
-        response = client.embeddings.create(model=EMBEDDING_MODEL, input=texts, dimensions=3072)
-        return [embedding.embedding for embedding in response.data]
+        return embedding_engine.embed(texts)
     except Exception as e:
         logger.error(f"Error embedding text: {e}")
         raise
 
-def store_chunks(chunks_data: List[tuple]):
-    if not chunks_data:
+# --- Query Embedding Cache ---
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+query_embedding_cache = TTLCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+persistent_embedding_stats = {"hits": 0, "misses": 0, "errors": 0}
+
+def normalize_query(query: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+def query_cache_key(query: str) -> str:
+    # The model and dimensions are part of the key so a model change never serves stale vectors.
+    raw = f"{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}:{normalize_query(query)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def load_persisted_query_embedding(cache_key: str) -> Optional[List[float]]:
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT embedding::real[] FROM query_embedding_cache
+                    WHERE cache_key = %s AND created_at > now() - make_interval(secs => %s)
+                    """,
+                    (cache_key, QUERY_EMBEDDING_CACHE_PERSIST_TTL)
+                )
+                row = cursor.fetchone()
+    except psycopg2.Error as e:
+        persistent_embedding_stats["errors"] += 1
+        logger.warning(f"Query embedding cache lookup failed: {e}")
+        return None
+    persistent_embedding_stats["hits" if row else "misses"] += 1
+    return row[0] if row else None
+
+def persist_query_embedding(cache_key: str, embedding: List[float]):
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO query_embedding_cache (cache_key, model, dimensions, embedding)
+                    VALUES (%s, %s, %s, %s::vector)
+                    ON CONFLICT (cache_key) DO UPDATE SET embedding = EXCLUDED.embedding, created_at = now()
+                    """,
+                    (cache_key, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, embedding)
+                )
+            conn.commit()
+    except psycopg2.Error as e:
+        persistent_embedding_stats["errors"] += 1
+        logger.warning(f"Could not persist query embedding: {e}")
+
+class QueryEmbeddingBatcher:
+    """Coalesces concurrent query embeddings into batched embeddings requests.
+
+    The first caller to arrive opens a batch and waits up to `window` seconds for others to join
+    (less if the batch reaches `max_batch`), then sends the whole batch from its own thread; the
+    other callers just wait for their vector. A query already waiting or in flight is not sent
+    again: later callers share its result. Results go into `cache` before the waiters are woken,
+    so a query arriving right after its batch completes finds it there.
+    """
+
+    def __init__(self, embed, window: float, max_batch: int, cache: Optional[TTLCache] = None):
+        self._embed = embed
+        self.window = window
+        self.max_batch = max_batch
+        self._cache = cache
+        self._open = None  # Batch still accepting queries
+        self._in_flight = {}  # cache key -> Future, until its batch has been answered
+        self._lock = threading.Lock()
+        self._stats = {"queries": 0, "coalesced": 0, "requests": 0, "largest_batch": 0}
+
+    def embed(self, key: str, text: str) -> List[float]:
+        if self.window <= 0:
+            return self._embed([text])[0]
+        lead, dispatch = False, None
+        with self._lock:
+            self._stats["queries"] += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+            else:
+                future = self._in_flight[key] = Future()
+                batch = self._open
+                if batch is None:
+                    batch = self._open = {"keys": [], "texts": [], "full": threading.Event()}
+                    lead = True
+                batch["keys"].append(key)
+                batch["texts"].append(text)
+                if len(batch["keys"]) >= self.max_batch:
+                    self._open, dispatch = None, batch
+                    batch["full"].set()
+        if lead and dispatch is None:
+            batch["full"].wait(self.window)
+            with self._lock:
+                if self._open is batch:
+                    self._open, dispatch = None, batch
+        if dispatch is not None:
+            self._send(dispatch)
+        return future.result()
+
+    def _send(self, batch: dict):
+        with self._lock:
+            futures = [self._in_flight[key] for key in batch["keys"]]
+            self._stats["requests"] += 1
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(futures))
+        try:
+            try:
+                vectors = self._embed(batch["texts"])
+            except openai.BadRequestError:
+                # Most likely one bad input; don't fail every query that happened to share its batch.
+                if len(futures) == 1:
+                    raise
+                vectors = []
+                for future, text in zip(futures, batch["texts"]):
+                    try:
+                        vectors.append(self._embed([text])[0])
+                    except openai.BadRequestError as e:
+                        vectors.append(e)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+        else:
+            for key, future, vector in zip(batch["keys"], futures, vectors):
+                if isinstance(vector, Exception):
+                    future.set_exception(vector)
+                    continue
+                if self._cache is not None:
+                    self._cache.set(key, vector)
+                future.set_result(vector)
+        finally:
+            with self._lock:
+                for key in batch["keys"]:
+                    self._in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, window_ms=self.window * 1000, max_batch=self.max_batch)
+
+query_embedding_batcher = QueryEmbeddingBatcher(
+    embed_text, QUERY_EMBED_BATCH_WINDOW, QUERY_EMBED_BATCH_MAX, cache=query_embedding_cache
+)
+
+def embed_query(query: str) -> List[float]:
+    cache_key = query_cache_key(query)
+    embedding = query_embedding_cache.get(cache_key)
+    if embedding is not None:
+        return embedding
+    if QUERY_EMBEDDING_CACHE_PERSIST:
+        embedding = load_persisted_query_embedding(cache_key)
+    if embedding is None:
+        embedding = query_embedding_batcher.embed(cache_key, query)
+        if QUERY_EMBEDDING_CACHE_PERSIST:
+            persist_query_embedding(cache_key, embedding)
+    query_embedding_cache.set(cache_key, embedding)
+    return embedding
+
+def embed_queries(queries: List[str]) -> List[np.ndarray]:
+    """Embeds many queries at once: cache misses go out together instead of one request per query.
+
+    Only the in-memory cache is consulted; the persisted cache would cost a round trip per query.
+    """
+    cache_keys = [query_cache_key(query) for query in queries]
+    embeddings = {key: query_embedding_cache.get(key) for key in cache_keys}
+    missing = {key: query for key, query in zip(cache_keys, queries) if embeddings[key] is None}
+    if missing:
+        for key, embedding in zip(missing, embed_text(list(missing.values()))):
+            query_embedding_cache.set(key, embedding)
+            embeddings[key] = embedding
+    return [embeddings[key] for key in cache_keys]
+
+# --- Answer Cache ---
+def bump_corpus_version(cursor):
+    # Runs inside the caller's transaction, so the version only moves if the corpus change commits.
+    cursor.execute("UPDATE corpus_state SET version = version + 1")
+
+_corpus_version = {"value": None, "checked_at": 0.0}
+
+def get_corpus_version() -> Optional[int]:
+    now = time.monotonic()
+    if _corpus_version["value"] is not None and now - _corpus_version["checked_at"] < CORPUS_VERSION_CHECK_INTERVAL:
+        return _corpus_version["value"]
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT version FROM corpus_state WHERE id = 1")
+                row = cursor.fetchone()
+    except psycopg2.Error as e:
+        logger.warning(f"Could not read corpus version: {e}")
+        return None
+    _corpus_version.update(value=row[0] if row else None, checked_at=now)
+    return _corpus_version["value"]
+
+class SemanticAnswerCache:
+    """Bounded LRU of answers, looked up by cosine distance between query embeddings.
+
+    Entries are only valid for the corpus version they were answered against; the whole cache is
+    dropped as soon as a newer version is seen.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, max_distance: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.corpus_version = None
+        self._entries = OrderedDict()  # id -> (unit vector, retrieval settings, answer, expires_at)
+        self._matrix = None  # Stacked unit vectors of _entries, rebuilt lazily after changes
+        self._ids = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _sync_version(self, corpus_version: int):
+        if corpus_version != self.corpus_version:
+            if self._entries:
+                self.invalidations += 1
+                logger.info(f"Corpus changed to version {corpus_version}; dropping {len(self._entries)} cached answers.")
+            self._entries.clear()
+            self._matrix = None
+            self.corpus_version = corpus_version
+
+    def lookup(self, embedding, settings: tuple, corpus_version: int) -> Optional[dict]:
+        # `settings` holds the retrieval options (n_results, search mode); answers are only shared between equal ones.
+        query = self._unit(embedding)
+        with self._lock:
+            self._sync_version(corpus_version)
+            if self._entries:
+                if self._matrix is None:
+                    self._ids = list(self._entries)
+                    self._matrix = np.vstack([self._entries[i][0] for i in self._ids])
+                distances = 1.0 - self._matrix @ query
+                now = time.monotonic()
+                for position in np.argsort(distances):
+                    if distances[position] > self.max_distance:
+                        break
+                    entry_id = self._ids[position]
+                    _, entry_settings, answer, expires_at = self._entries[entry_id]
+                    if entry_settings == settings and expires_at > now:
+                        self._entries.move_to_end(entry_id)
+                        self.hits += 1
+                        return answer
+            self.misses += 1
+            return None
+
+    def store(self, embedding, settings: tuple, corpus_version: int, answer: dict):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._sync_version(corpus_version)
+            self._entries[self._next_id] = (self._unit(embedding), settings, answer, time.monotonic() + self.ttl)
+            self._next_id += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "invalidations": self.invalidations,
+                "corpus_version": self.corpus_version,
+            }
+
+# A size of 0 stores nothing, so every lookup misses.
+answer_cache = SemanticAnswerCache(
+    ANSWER_CACHE_SIZE if ANSWER_CACHE_ENABLED else 0, ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_DISTANCE
+)
+
+def cache_stats() -> dict:
+    stats = {
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "query_embedding_batcher": query_embedding_batcher.stats(),
+        "answer_cache": answer_cache.stats(),
+        "embeddings": embedding_engine.stats(),
+    }
+    if QUERY_EMBEDDING_CACHE_PERSIST:
+        stats["query_embedding_cache"]["persistent"] = dict(persistent_embedding_stats)
+    return stats
+
+# --- Chunk Storage ---
+CHUNK_ROW_COLUMNS = (
+    "doc_id", "doc_name", "chunk_index", "text", "embedding", "filename", "page_numbers", "title", "source_type", "text_hash"
+)
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_TRAILER = struct.pack("!h", -1)
+_INT4_OID = 23
+
+def _copy_text(value, encoding: str) -> bytes:
+    if value is None:
+        return struct.pack("!i", -1)
+    data = str(value).encode(encoding)
+    return struct.pack("!i", len(data)) + data
+
+def _copy_vector(embedding) -> bytes:
+    # pgvector's binary format: int16 dimensions, int16 unused, then big-endian float4s.
+    values = np.asarray(embedding, dtype=">f4")
+    return struct.pack("!ihh", 4 + 4 * len(values), len(values), 0) + values.tobytes()
+
+def _copy_int4_array(values) -> bytes:
+    if values is None:
+        return struct.pack("!i", -1)
+    body = struct.pack("!iiiii", 1, 0, _INT4_OID, len(values), 1)
+    body += b"".join(struct.pack("!ii", 4, value) for value in values)
+    return struct.pack("!i", len(body)) + body
+
+def encode_copy_row(row: tuple, encoding: str) -> bytes:
+    """One chunk row (in CHUNK_ROW_COLUMNS order) in PostgreSQL's binary COPY format."""
+    doc_id, doc_name, chunk_index, text, embedding, filename, page_numbers, title, source_type, text_hash = row
+    return b"".join((
+        struct.pack("!h", len(CHUNK_ROW_COLUMNS)),
+        _copy_text(doc_id, encoding), _copy_text(doc_name, encoding),
+        struct.pack("!ii", 4, chunk_index),
+        _copy_text(text, encoding), _copy_vector(embedding), _copy_text(filename, encoding),
+        _copy_int4_array(page_numbers), _copy_text(title, encoding), _copy_text(source_type, encoding),
+        _copy_text(text_hash, encoding),
+    ))
+
+class CopyStream:
+    """File-like reader over an iterator of byte strings, so COPY input is encoded as it is sent."""
+
+    def __init__(self, parts):
+        self._parts = iter(parts)
+        self._buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            part = next(self._parts, None)
+            if part is None:
+                break
+            self._buffer += part
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    readline = read
+
+def copy_chunks_to_staging(cursor, chunks_data: List[tuple]):
+    # A temp table is never WAL-logged, is private to this connection, and is emptied at commit, so
+    # concurrent writers cannot see each other's rows. It is created once per pooled connection.
+    cursor.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS chunks_staging (
+            doc_id TEXT, doc_name TEXT, chunk_index INTEGER, text TEXT, embedding VECTOR({EMBEDDING_DIMENSIONS}),
+            filename TEXT, page_numbers INTEGER[], title TEXT, source_type TEXT, text_hash TEXT
+        ) ON COMMIT DELETE ROWS
+    """)
+    encoding = psycopg2.extensions.encodings[cursor.connection.encoding]
+    parts = itertools.chain((_COPY_HEADER,), (encode_copy_row(row, encoding) for row in chunks_data), (_COPY_TRAILER,))
+    cursor.copy_expert(
+        f"COPY chunks_staging ({', '.join(CHUNK_ROW_COLUMNS)}) FROM STDIN WITH (FORMAT binary)", CopyStream(parts)
+    )
+
+@timed("store")
+def store_chunks(chunks_data: List[tuple], documents: Optional[List[dict]] = None):
+    """Upserts chunk rows and, for each synced document, drops its orphaned chunks and records its state.
+
+    Rows are streamed into a staging table with binary COPY and merged into chunks with one
+    statement; rows whose content did not change are left alone. Everything happens in one
+    transaction, so a document is only marked as synced once all of its chunks are in place.
+    """
+    if not chunks_data and not documents:
         logger.info("No chunks to store.")
         return
-    conn = None
     try:
-        conn = psycopg2.connect(**DB_PARAMS)
-        cursor = conn.cursor()
-        insert_query = """
-        INSERT INTO chunks (doc_id, doc_name, chunk_index, text, embedding, filename, page_numbers, title, source_type)
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                if chunks_data:
+                    copy_chunks_to_staging(cursor, chunks_data)
+                    cursor.execute(f"""
+                        INSERT INTO chunks ({', '.join(CHUNK_ROW_COLUMNS)})
+                        SELECT {', '.join(CHUNK_ROW_COLUMNS)} FROM chunks_staging
+                        ON CONFLICT (doc_id, chunk_index, source_type) DO UPDATE SET
+                            doc_name = EXCLUDED.doc_name,
+                            text = EXCLUDED.text,
+                            embedding = EXCLUDED.embedding,
+                            filename = EXCLUDED.filename,
+                            page_numbers = EXCLUDED.page_numbers,
+                            title = EXCLUDED.title,
+                            text_hash = EXCLUDED.text_hash
+                        WHERE (chunks.text_hash, chunks.doc_name, chunks.filename, chunks.page_numbers, chunks.title)
+                            IS DISTINCT FROM
+                            (EXCLUDED.text_hash, EXCLUDED.doc_name, EXCLUDED.filename, EXCLUDED.page_numbers, EXCLUDED.title)
+                    """)
+                    written = cursor.rowcount
+                if documents:
+                    execute_values(cursor, """
+                        DELETE FROM chunks c
+                        USING (VALUES %s) AS d (doc_id, source_type, chunk_count)
+                        WHERE c.doc_id = d.doc_id AND c.source_type = d.source_type AND c.chunk_index >= d.chunk_count
+                    """, [(d["doc_id"], d["source_type"], d["chunk_count"]) for d in documents])
+                    record_document_state(cursor, documents)
+                bump_corpus_version(cursor)
+            conn.commit()
+        if chunks_data:
+            logger.info(f"Stored {len(chunks_data)} chunks ({written} new or changed).")
+    except psycopg2.Error as e:
+        logger.error(f"Error storing chunks: {e}")
+        raise
+
+# --- Document Sync State ---
+def record_document_state(cursor, documents: List[dict]):
+    execute_values(cursor, """
+        INSERT INTO documents (doc_id, source_type, source_root, doc_name, modified_marker, content_hash, chunk_count)
         VALUES %s
-        ON CONFLICT (doc_id, chunk_index, source_type) DO UPDATE SET
+        ON CONFLICT (doc_id, source_type) DO UPDATE SET
+            source_root = EXCLUDED.source_root,
             doc_name = EXCLUDED.doc_name,
-            text = EXCLUDED.text,
-            embedding = EXCLUDED.embedding,
-            filename = EXCLUDED.filename,
-            page_numbers = EXCLUDED.page_numbers,
-            title = EXCLUDED.title;
-        """
-        execute_values(cursor, insert_query, chunks_data, template="(%s, %s, %s, %s, %s::vector, %s, %s, %s, %s)")
+            modified_marker = EXCLUDED.modified_marker,
+            content_hash = EXCLUDED.content_hash,
+            chunk_count = COALESCE(EXCLUDED.chunk_count, documents.chunk_count),
+            synced_at = now()
+    """, [
+        (d["doc_id"], d["source_type"], d["source_root"], d["doc_name"],
+         d.get("modified_marker"), d.get("content_hash"), d.get("chunk_count"))
+        for d in documents
+    ])
+
+def load_document_state(source_type: str, source_root: str) -> dict:
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT doc_id, modified_marker, content_hash FROM documents WHERE source_type = %s AND source_root = %s",
+                (source_type, source_root)
+            )
+            return {row[0]: {"modified_marker": row[1], "content_hash": row[2]} for row in cursor.fetchall()}
+
+def touch_documents(documents: List[dict]):
+    # Metadata changed but content did not (e.g. a re-saved file): remember the new marker only.
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            record_document_state(cursor, documents)
         conn.commit()
-        logger.info(f"Stored/Updated {len(chunks_data)} chunks.")
-    except psycopg2.Error as e:
-        logger.error(f"Error storing chunks: {e}")
-    finally:
-        if conn:
-            cursor.close()
-            conn.close()
+
+def remove_documents(source_type: str, doc_ids: List[str]) -> int:
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM chunks WHERE source_type = %s AND doc_id = ANY(%s)", (source_type, doc_ids))
+            removed_chunks = cursor.rowcount
+            cursor.execute("DELETE FROM documents WHERE source_type = %s AND doc_id = ANY(%s)", (source_type, doc_ids))
+            bump_corpus_version(cursor)
+        conn.commit()
+    logger.info(f"Removed {len(doc_ids)} documents ({removed_chunks} chunks) no longer present in the source.")
+    return removed_chunks
+
+def load_reusable_embeddings(doc_id: str, source_type: str, text_hashes: List[str]) -> dict:
+    if not text_hashes:
+        return {}
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT DISTINCT ON (text_hash) text_hash, embedding::real[]
+                FROM chunks
+                WHERE doc_id = %s AND source_type = %s AND text_hash = ANY(%s)
+            """, (doc_id, source_type, text_hashes))
+            return {row[0]: np.asarray(row[1], dtype=np.float32) for row in cursor.fetchall()}
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def is_document_unchanged(doc: dict, previous: Optional[dict]) -> bool:
+    if previous is None:
+        return False
+    if doc["modified_marker"] and doc["modified_marker"] == previous["modified_marker"]:
+        return True
+    # The marker moved; compare content. Local files are only hashed once their mtime/size changed.
+    if doc.get("path") and not doc.get("content_hash"):
+        doc["content_hash"] = file_sha256(doc["path"])
+    return bool(doc.get("content_hash")) and doc["content_hash"] == previous["content_hash"]
 
 # --- Document Processing ---
-def process_documents(source_type: str, google_drive_folder_id: Optional[str] = None, local_folder_path: Optional[str] = None):
+def convert_and_chunk(converter, chunker, path: str, timings: Optional[dict] = None) -> List[dict]:
+    started = time.perf_counter()
+    result = converter.convert(path)
+    converted = time.perf_counter()
+    chunks = []
+    for chunk in chunker.chunk(dl_doc=result.document):
+        page_numbers = sorted(list(set(prov.page_no for item in chunk.meta.doc_items for prov in item.prov if prov.page_no is not None))) or None
+        title = chunk.meta.headings[0] if chunk.meta.headings else None
+        chunks.append({
+            "text": chunk.text, "page_numbers": page_numbers, "title": title,
+            "filename": chunk.meta.origin.filename, "text_hash": text_sha256(chunk.text),
+        })
+    if timings is not None:
+        timings.update(convert=converted - started, chunk=time.perf_counter() - converted)
+    return chunks
+
+def build_chunk_rows(doc: dict, chunks: List[dict]):
+    """Embeds only the chunks whose text is not already stored for this document.
+
+    Returns the rows to store and how many chunks had to be embedded.
+    """
+    reusable = load_reusable_embeddings(doc["doc_id"], doc["source_type"], list({c["text_hash"] for c in chunks}))
+    to_embed = [c for c in chunks if c["text_hash"] not in reusable]
+    new_embeddings = dict(zip((c["text_hash"] for c in to_embed), embed_text([c["text"] for c in to_embed])))
+    rows = []
+    for i, chunk in enumerate(chunks):
+        embedding = reusable[chunk["text_hash"]] if chunk["text_hash"] in reusable else new_embeddings[chunk["text_hash"]]
+        rows.append((
+            doc["doc_id"], doc["doc_name"], i, chunk["text"], embedding,
+            chunk["filename"], chunk["page_numbers"], chunk["title"], doc["source_type"], chunk["text_hash"]
+        ))
+    return rows, len(to_embed)
+
+# --- Ingestion Pipeline ---
+_PIPELINE_STOP = object()
+
+def run_pipeline(items, stages: List[tuple], queue_size: int = INGEST_QUEUE_SIZE):
+    """Pushes items through `stages`, a list of (name, func, workers), and yields (item, error) as they finish.
+
+    Every stage has its own worker threads reading from a bounded queue, so a slow stage makes the
+    ones before it block instead of piling up files in memory. Each func takes the item and returns
+    it (usually enriched); once a stage raises, later stages pass the item through untouched.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages] + [queue.Queue()]
+    remaining = [workers for _, _, workers in stages]
+    lock = threading.Lock()
+
+    def feed():
+        for item in items:
+            queues[0].put((item, None))
+        for _ in range(stages[0][2]):
+            queues[0].put(_PIPELINE_STOP)
+
+    def work(index: int):
+        name, func, _ = stages[index]
+        inbox, outbox = queues[index], queues[index + 1]
+        while True:
+            entry = inbox.get()
+            if entry is _PIPELINE_STOP:
+                break
+            item, error = entry
+            if error is None:
+                try:
+                    item = func(item)
+                except Exception as e:
+                    logger.debug(f"Ingestion stage '{name}' failed: {e}")
+                    error = e
+            outbox.put((item, error))
+        # The last worker of a stage to finish tells every worker of the next stage to stop.
+        with lock:
+            remaining[index] -= 1
+            if remaining[index] == 0:
+                next_workers = stages[index + 1][2] if index + 1 < len(stages) else 1
+                for _ in range(next_workers):
+                    outbox.put(_PIPELINE_STOP)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for index, (name, _, workers) in enumerate(stages):
+        threads.extend(threading.Thread(target=work, args=(index,), name=f"ingest-{name}-{n}", daemon=True) for n in range(workers))
+    for thread in threads:
+        thread.start()
+    while True:
+        entry = queues[-1].get()
+        if entry is _PIPELINE_STOP:
+            break
+        yield entry
+    for thread in threads:
+        thread.join()
+
+# --- Conversion Runtime ---
+# Docling models are loaded once per conversion process by the pool initializer, not once per file.
+_conversion_runtime = {}
+
+def _init_conversion_worker():
+    from docling.chunking import HybridChunker
+    from docling.datamodel.base_models import InputFormat
+    from docling.document_converter import DocumentConverter
     converter = DocumentConverter()
-    chunker = HybridChunker(tokenizer="bert-base-uncased", max_tokens=MAX_TOKENS - 100, merge_peers=True)
-    all_chunks_to_store = []
-    batch_size = 5  # Process 5 files at a time to reduce memory usage
+    # Load the PDF pipeline's models now rather than during the first conversion.
+    converter.initialize_pipeline(InputFormat.PDF)
+    _conversion_runtime["converter"] = converter
+    _conversion_runtime["chunker"] = HybridChunker(tokenizer="bert-base-uncased", max_tokens=MAX_TOKENS - 100, merge_peers=True)
+
+def _conversion_worker_ready():
+    pass
+
+_converter_pool: Optional[ProcessPoolExecutor] = None
+_converter_pool_lock = threading.Lock()
+_converter_pool_users = 0
+_converter_idle_timer: Optional[threading.Timer] = None
+
+def get_converter_pool() -> ProcessPoolExecutor:
+    """Conversion processes, started on first use and kept warm across process_documents calls.
+
+    Call it inside converter_pool_in_use(), or the idle timeout may shut the pool down under you.
+    """
+    global _converter_pool
+    with _converter_pool_lock:
+        if _converter_pool is None:
+            # spawn, not fork: this process already runs threads and holds pooled database connections.
+            _converter_pool = ProcessPoolExecutor(
+                max_workers=INGEST_CONVERT_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_conversion_worker
+            )
+        return _converter_pool
+
+@contextmanager
+def converter_pool_in_use():
+    """Keeps the conversion pool alive while the block runs.
+
+    Once nothing is using it, the pool is shut down after INGEST_CONVERT_IDLE_TIMEOUT seconds, so an
+    idle worker does not hold the Docling models between jobs. The next job starts a fresh pool.
+    """
+    global _converter_pool_users, _converter_idle_timer
+    with _converter_pool_lock:
+        _converter_pool_users += 1
+        if _converter_idle_timer is not None:
+            _converter_idle_timer.cancel()
+            _converter_idle_timer = None
+    try:
+        yield
+    finally:
+        with _converter_pool_lock:
+            _converter_pool_users -= 1
+            if _converter_pool_users == 0 and _converter_pool is not None and INGEST_CONVERT_IDLE_TIMEOUT > 0:
+                _converter_idle_timer = threading.Timer(INGEST_CONVERT_IDLE_TIMEOUT, _shutdown_idle_converter_pool)
+                _converter_idle_timer.daemon = True
+                _converter_idle_timer.start()
+
+def _shutdown_idle_converter_pool():
+    global _converter_pool, _converter_idle_timer
+    with _converter_pool_lock:
+        # A job may have started, or another timer replaced this one, since it was scheduled.
+        if _converter_pool_users or _converter_idle_timer is not threading.current_thread():
+            return
+        pool, _converter_pool, _converter_idle_timer = _converter_pool, None, None
+    if pool is not None:
+        logger.info(f"Shutting down conversion processes after {INGEST_CONVERT_IDLE_TIMEOUT:.0f}s idle.")
+        pool.shutdown(wait=True)
 
+def warm_converter_pool():
+    """Starts the conversion processes so their models are loaded before the first document arrives."""
+    with converter_pool_in_use():
+        pool = get_converter_pool()
+        started = time.monotonic()
+        for future in [pool.submit(_conversion_worker_ready) for _ in range(INGEST_CONVERT_PROCESSES)]:
+            future.result()
+        logger.info(f"Conversion pool ready in {time.monotonic() - started:.1f}s.")
+
+def shutdown_converter_pool():
+    global _converter_pool, _converter_idle_timer
+    with _converter_pool_lock:
+        pool, _converter_pool = _converter_pool, None
+        if _converter_idle_timer is not None:
+            _converter_idle_timer.cancel()
+            _converter_idle_timer = None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def _discard_broken_converter_pool(pool: ProcessPoolExecutor):
+    # A conversion process died (e.g. killed for memory); the next file gets a fresh pool.
+    global _converter_pool
+    with _converter_pool_lock:
+        if _converter_pool is pool:
+            _converter_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def convert_document(path: str) -> tuple:
+    # Timings are measured here, in the conversion process, and returned alongside the chunks.
+    timings = {}
+    chunks = convert_and_chunk(_conversion_runtime["converter"], _conversion_runtime["chunker"], path, timings)
+    return chunks, timings
+
+def list_source_documents(source_type: str, google_drive_folder_id: Optional[str], local_folder_path: Optional[str]):
     if source_type == "google_drive":
         if not google_drive_folder_id:
             raise ValueError("Google Drive Folder ID required.")
-        gdrive_files = list_gdrive_files(google_drive_folder_id)
-        if not gdrive_files:
-            logger.info("No files found in Google Drive folder.")
-            return
-
-        # Process files in batches
-        for i in range(0, len(gdrive_files), batch_size):
-            batch_files = gdrive_files[i:i + batch_size]
-            logger.info(f"Processing batch of {len(batch_files)} files (batch {i//batch_size + 1})")
-            
-            for file_info in batch_files:
-                if file_info.get('mimeType') == 'application/vnd.google-apps.folder':
-                    continue
-                file_name = file_info['name']
-                file_id = file_info['id']
-                mime_type = file_info['mimeType']
-                downloaded_path = None
-                try:
-                    downloaded_path = download_gdrive_file(file_id, file_name, mime_type)
-                    result = converter.convert(downloaded_path)
-                    document = result.document
-                    chunk_iter = chunker.chunk(dl_doc=document)
-                    doc_chunks = list(chunk_iter)
-                    if not doc_chunks:
-                        logger.warning(f"No chunks for file: {file_name}")
-                        continue
-                    chunk_texts = [chunk.text for chunk in doc_chunks]
-                    embeddings = embed_text(chunk_texts)
-                    for j, chunk in enumerate(doc_chunks):
-                        page_numbers = sorted(list(set(prov.page_no for item in chunk.meta.doc_items for prov in item.prov if prov.page_no is not None))) or None
-                        title = chunk.meta.headings[0] if chunk.meta.headings else None
-                        all_chunks_to_store.append((
-                            file_id, file_name, j, chunk.text, embeddings[j],
-                            chunk.meta.origin.filename, page_numbers, title, "google_drive"
-                        ))
-                except Exception as e:
-                    logger.error(f"Error processing file {file_name}: {e}")
-                finally:
-                    if downloaded_path and os.path.exists(downloaded_path):
-                        os.remove(downloaded_path)
-            
-            # Store chunks for the current batch
-            if all_chunks_to_store:
-                store_chunks(all_chunks_to_store)
-                all_chunks_to_store = []  # Clear chunks after storing to free memory
-                logger.info(f"Stored chunks for batch {i//batch_size + 1}")
-
-    elif source_type == "local":
+        documents = [
+            {
+                "doc_id": f["id"], "doc_name": f["name"], "mime_type": f["mimeType"],
+                "modified_marker": f.get("modifiedTime"), "content_hash": f.get("md5Checksum"),
+                "source_type": source_type, "source_root": google_drive_folder_id,
+            }
+            for f in list_gdrive_files(google_drive_folder_id)
+        ]
+        return google_drive_folder_id, documents
+    if source_type == "local":
         if not local_folder_path or not os.path.isdir(local_folder_path):
             raise ValueError(f"Invalid local folder path: {local_folder_path}")
-        pdf_files = glob.glob(os.path.join(local_folder_path, "*.pdf"))
-        if not pdf_files:
-            logger.info(f"No PDF files in {local_folder_path}.")
-            return
-        for pdf_path in pdf_files:
+        source_root = os.path.abspath(local_folder_path)
+        documents = []
+        for pdf_path in glob.glob(os.path.join(local_folder_path, "*.pdf")):
             doc_name = os.path.basename(pdf_path)
-            doc_id = doc_name
-            try:
-                result = converter.convert(pdf_path)
-                document = result.document
-                chunk_iter = chunker.chunk(dl_doc=document)
-                doc_chunks = list(chunk_iter)
-                if not doc_chunks:
-                    logger.warning(f"No chunks for PDF: {doc_name}")
-                    continue
-                chunk_texts = [chunk.text for chunk in doc_chunks]
-                embeddings = embed_text(chunk_texts)
-                for i, chunk in enumerate(doc_chunks):
-                    page_numbers = sorted(list(set(prov.page_no for item in chunk.meta.doc_items for prov in item.prov if prov.page_no is not None))) or None
-                    title = chunk.meta.headings[0] if chunk.meta.headings else None
-                    all_chunks_to_store.append((
-                        doc_id, doc_name, i, chunk.text, embeddings[i],
-                        doc_name, page_numbers, title, "local"
-                    ))
-            except Exception as e:
-                logger.error(f"Error processing PDF {doc_name}: {e}")
-        if all_chunks_to_store:
-            store_chunks(all_chunks_to_store)
+            stat = os.stat(pdf_path)
+            documents.append({
+                "doc_id": doc_name, "doc_name": doc_name, "path": pdf_path,
+                "modified_marker": f"{stat.st_mtime_ns}:{stat.st_size}", "content_hash": None,
+                "source_type": source_type, "source_root": source_root,
+            })
+        return source_root, documents
+    raise ValueError(f"Unsupported source type: {source_type}")
+
+def file_progress(doc: dict, status: str, **details) -> dict:
+    return {"doc_id": doc["doc_id"], "doc_name": doc["doc_name"], "status": status, **details}
+
+def process_documents(source_type: str, google_drive_folder_id: Optional[str] = None, local_folder_path: Optional[str] = None,
+                      progress=None) -> dict:
+    """Syncs a source folder into the chunks table and returns counts of what changed.
+
+    `progress`, if given, is called with lists of per-file updates (see file_progress) as files
+    are planned, stored or fail.
+    """
+    report = progress or (lambda updates: None)
+    summary = {
+        "files_skipped": 0, "files_added": 0, "files_updated": 0, "files_removed": 0, "files_failed": 0,
+        "chunks_embedded": 0, "chunks_reused": 0, "processed_files": [],
+    }
+    source_root, documents = list_source_documents(source_type, google_drive_folder_id, local_folder_path)
+    known = load_document_state(source_type, source_root)
+
+    removed = sorted(set(known) - {doc["doc_id"] for doc in documents})
+    if removed:
+        remove_documents(source_type, removed)
+        summary["files_removed"] = len(removed)
+        report([{"doc_id": doc_id, "doc_name": doc_id, "status": "removed"} for doc_id in removed])
+
+    changed, touched = [], []
+    for doc in documents:
+        previous = known.get(doc["doc_id"])
+        if is_document_unchanged(doc, previous):
+            summary["files_skipped"] += 1
+            if doc["modified_marker"] != previous["modified_marker"]:
+                touched.append(doc)
+        else:
+            changed.append((doc, previous is not None))
+    if touched:
+        touch_documents(touched)
+    changed_ids = {doc["doc_id"] for doc, _ in changed}
+    report(
+        [file_progress(doc, "skipped") for doc in documents if doc["doc_id"] not in changed_ids]
+        + [file_progress(doc, "queued") for doc, _ in changed]
+    )
+    logger.info(f"{len(changed)} new or changed files, {summary['files_skipped']} unchanged, {len(removed)} removed.")
+    if not changed:
+        return summary
+
+    def fetch(entry: dict) -> dict:
+        doc = entry["doc"]
+        started = time.monotonic()
+        if source_type == "google_drive":
+            entry["path"] = entry["downloaded_path"] = download_gdrive_file(
+                doc["doc_id"], doc["doc_name"], doc["mime_type"], download_dir
+            )
+        else:
+            entry["path"] = doc["path"]
+            if not doc["content_hash"]:
+                doc["content_hash"] = file_sha256(doc["path"])
+        entry["timings"]["fetch"] = time.monotonic() - started
+        return entry
+
+    def convert(entry: dict) -> dict:
+        # Conversion is CPU bound, so the thread only waits on a process from the pool.
+        converter_pool = get_converter_pool()
+        try:
+            entry["chunks"], conversion_timings = converter_pool.submit(convert_document, entry["path"]).result()
+        except BrokenProcessPool:
+            _discard_broken_converter_pool(converter_pool)
+            raise
+        finally:
+            if entry.get("downloaded_path") and os.path.exists(entry["downloaded_path"]):
+                os.remove(entry["downloaded_path"])
+        entry["timings"].update(conversion_timings)
+        if not entry["chunks"]:
+            logger.warning(f"No chunks for file: {entry['doc']['doc_name']}")
+        return entry
+
+    def embed(entry: dict) -> dict:
+        started = time.monotonic()
+        entry["rows"], entry["embedded"] = build_chunk_rows(entry["doc"], entry.pop("chunks"))
+        entry["timings"]["embed"] = time.monotonic() - started
+        return entry
+
+    pending = []
+
+    def observe_timings(entry: dict):
+        # Per-file stage timings; storing is observed by store_chunks itself, once per batch.
+        for stage, seconds in entry["timings"].items():
+            observe_stage(f"ingest_{stage}", seconds)
+
+    def flush():
+        if not pending:
+            return
+        rows = [row for entry in pending for row in entry["rows"]]
+        documents = [dict(entry["doc"], chunk_count=len(entry["rows"])) for entry in pending]
+        started = time.monotonic()
+        try:
+            store_chunks(rows, documents=documents)
+        except psycopg2.Error as e:
+            summary["files_failed"] += len(pending)
+            report([file_progress(entry["doc"], "failed", error=f"Storing chunks failed: {e}") for entry in pending])
+        else:
+            stored_in = time.monotonic() - started
+            updates = []
+            for entry in pending:
+                observe_timings(entry)
+                status = "updated" if entry["existed"] else "added"
+                summary[f"files_{status}"] += 1
+                summary["chunks_embedded"] += entry["embedded"]
+                summary["chunks_reused"] += len(entry["rows"]) - entry["embedded"]
+                summary["processed_files"].append(entry["doc"]["doc_name"])
+                timings = dict(entry["timings"], store=stored_in)
+                updates.append(file_progress(
+                    entry["doc"], status, chunks=len(entry["rows"]), embedded=entry["embedded"],
+                    seconds=time.monotonic() - entry["started"], timings=timings
+                ))
+            report(updates)
+        pending.clear()
+
+    stages = [
+        ("fetch", fetch, INGEST_DOWNLOAD_WORKERS),
+        ("convert", convert, INGEST_CONVERT_PROCESSES),
+        ("embed", embed, INGEST_EMBED_WORKERS),
+    ]
+    with converter_pool_in_use(), tempfile.TemporaryDirectory(prefix="ingest-") as download_dir:
+        entries = (
+            {"doc": doc, "existed": existed, "started": time.monotonic(), "timings": {}}
+            for doc, existed in changed
+        )
+        for entry, error in run_pipeline(entries, stages):
+            if error is not None:
+                summary["files_failed"] += 1
+                logger.error(f"Error processing file {entry['doc']['doc_name']}: {error}")
+                observe_timings(entry)
+                report([file_progress(
+                    entry["doc"], "failed", error=str(error),
+                    seconds=time.monotonic() - entry["started"], timings=entry["timings"]
+                )])
+                continue
+            # Storing stays on this thread: one writer, batched transactions.
+            pending.append(entry)
+            if len(pending) >= INGEST_STORE_BATCH_SIZE:
+                flush()
+        flush()
+    return summary
+
+# --- Ingestion Jobs ---
+INGEST_JOB_CHANNEL = "ingest_jobs"  # NOTIFY channel that wakes up worker.py
+
+def enqueue_ingest_job(request: dict) -> int:
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("INSERT INTO ingest_jobs (request) VALUES (%s) RETURNING id", (Json(request),))
+            job_id = cursor.fetchone()[0]
+            cursor.execute("SELECT pg_notify(%s, %s)", (INGEST_JOB_CHANNEL, str(job_id)))
+        conn.commit()
+    logger.info(f"Queued ingestion job {job_id}.")
+    return job_id
+
+def get_ingest_job(job_id: int) -> Optional[dict]:
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, status, request, summary, error, attempts, created_at, started_at, heartbeat_at, finished_at
+                FROM ingest_jobs WHERE id = %s
+            """, (job_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute("SELECT status, count(*) FROM ingest_job_files WHERE job_id = %s GROUP BY status", (job_id,))
+            file_counts = dict(cursor.fetchall())
+    return {
+        "job_id": row[0], "status": row[1], "request": row[2], "summary": row[3], "error": row[4],
+        "attempts": row[5], "created_at": row[6], "started_at": row[7], "heartbeat_at": row[8],
+        "finished_at": row[9], "file_counts": file_counts,
+    }
+
+def list_ingest_job_files(job_id: int) -> List[dict]:
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT doc_id, doc_name, status, chunks, embedded, seconds, timings, error, updated_at
+                FROM ingest_job_files WHERE job_id = %s ORDER BY doc_name
+            """, (job_id,))
+            return [
+                {
+                    "doc_id": row[0], "doc_name": row[1], "status": row[2], "chunks": row[3], "embedded": row[4],
+                    "seconds": row[5], "timings": row[6], "error": row[7], "updated_at": row[8]
+                }
+                for row in cursor.fetchall()
+            ]
 
 # --- RAG Query Functions ---
-def search_chunks(query: str, n_results: int = 5) -> List[dict]:
-    conn = None
-    try:
-        conn = psycopg2.connect(**DB_PARAMS)
-        cursor = conn.cursor()
-        query_embedding = embed_text([query])[0]
-        cursor.execute("""
-            SELECT doc_id, doc_name, chunk_index, text, filename, page_numbers, title, source_type,
-                   (embedding <=> %s::vector) as distance
+CHUNK_COLUMNS = "doc_id, doc_name, chunk_index, text, filename, page_numbers, title, source_type"
+
+# Candidate ordering used by the first, index-backed phase of an ANN search.
+ANN_CANDIDATE_ORDER = {
+    "halfvec": f"embedding::halfvec({EMBEDDING_DIMENSIONS}) <=> {{embedding}}::halfvec({EMBEDDING_DIMENSIONS})",
+    "binary": f"binary_quantize(embedding)::bit({EMBEDDING_DIMENSIONS}) <~> binary_quantize({{embedding}})",
+}
+
+# How each named search parameter is sent to EXECUTE.
+SEARCH_PARAM_PLACEHOLDERS = {"embedding": "%s::vector", "embeddings": "%s::text[]", "query_texts": "%s::text[]"}
+
+def build_search_sql(search_mode: str, batch: bool = False):
+    """Returns the search statement for `search_mode` and the names of its $n parameters, in order.
+
+    A batch statement answers many queries in one round trip: it unnests arrays of embeddings and
+    query texts and runs the same search for each pair through a LATERAL join. Its rows carry the
+    0-based `query_index` of the query they belong to and come back grouped in query order.
+    """
+    params = []
+
+    def param(name: str) -> str:
+        if name not in params:
+            params.append(name)
+        return f"${params.index(name) + 1}"
+
+    embedding = "q.embedding" if batch else f"{param('embedding')}::vector"
+    n_results = param("n_results")
+
+    if ANN_MODE == "exact":
+        vector_source = "chunks"
+    else:
+        # Two-phase search: candidates come from the ANN index and are re-ranked exactly below.
+        vector_source = f"""(
+            SELECT id, {CHUNK_COLUMNS}, embedding
             FROM chunks
+            ORDER BY {ANN_CANDIDATE_ORDER[ANN_MODE].format(embedding=embedding)}
+            LIMIT {param("ann_candidates")}
+        ) AS ann_candidates"""
+
+    if search_mode == "vector":
+        sql = f"""
+            SELECT {CHUNK_COLUMNS}, (embedding <=> {embedding}) as distance
+            FROM {vector_source}
             ORDER BY distance ASC
-            LIMIT %s
-        """, (query_embedding, n_results))
-        results = [
-            {
-                "doc_id": row[0], "doc_name": row[1], "chunk_index": row[2],
-                "text": row[3], "filename": row[4], "page_numbers": row[5],
-                "title": row[6], "source_type": row[7], "distance": row[8]
-            }
-            for row in cursor.fetchall()
-        ]
-        return results
+            LIMIT {n_results}
+        """
+        rank_order = "hits.distance ASC"
+    else:
+        # Both retrievers run in one statement and are fused with weighted RRF: sum(weight / (k + rank)).
+        # Written with subqueries rather than CTEs so the batch form can reference the outer query.
+        query_text = "q.query_text" if batch else param("query_text")
+        sql = f"""
+            SELECT {", ".join(f"c.{column.strip()}" for column in CHUNK_COLUMNS.split(","))},
+                   (c.embedding <=> {embedding}) AS distance, f.score
+            FROM (
+                SELECT coalesce(v.id, t.id) AS id,
+                       coalesce({param("vector_weight")}::float8 / ({param("rrf_k")}::int + v.rank), 0)
+                       + coalesce({param("text_weight")}::float8 / ({param("rrf_k")}::int + t.rank), 0) AS score
+                FROM (
+                    SELECT id, row_number() OVER (ORDER BY distance) AS rank
+                    FROM (
+                        SELECT id, (embedding <=> {embedding}) AS distance
+                        FROM {vector_source}
+                        ORDER BY distance ASC
+                        LIMIT {param("candidates")}
+                    ) AS nearest
+                ) AS v
+                FULL OUTER JOIN (
+                    SELECT id, row_number() OVER (ORDER BY ts_rank_cd(tsv, query) DESC) AS rank
+                    FROM chunks, websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', {query_text}) AS query
+                    WHERE tsv @@ query
+                    ORDER BY ts_rank_cd(tsv, query) DESC
+                    LIMIT {param("candidates")}
+                ) AS t ON t.id = v.id
+            ) AS f
+            JOIN chunks c ON c.id = f.id
+            ORDER BY f.score DESC
+            LIMIT {n_results}
+        """
+        rank_order = "hits.score DESC"
+
+    if batch:
+        sql = f"""
+            SELECT q.query_index, hits.*
+            FROM unnest({param("embeddings")}::text[], {param("query_texts")}::text[]) WITH ORDINALITY AS input(embedding, query_text, position)
+            CROSS JOIN LATERAL (
+                SELECT input.embedding::vector({EMBEDDING_DIMENSIONS}) AS embedding, input.query_text,
+                       input.position - 1 AS query_index
+            ) AS q
+            CROSS JOIN LATERAL ({sql}) AS hits
+            ORDER BY q.query_index, {rank_order}
+        """
+    return sql, tuple(params)
+
+SEARCH_STATEMENTS = {mode: build_search_sql(mode) for mode in ("vector", "hybrid")}
+BATCH_SEARCH_STATEMENTS = {mode: build_search_sql(mode, batch=True) for mode in ("vector", "hybrid")}
+
+def apply_ann_search_settings(cursor, candidates: int):
+    # is_local=true scopes the setting to this transaction, so pooled connections keep their defaults.
+    if ANN_INDEX_TYPE == "hnsw":
+        cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(max(HNSW_EF_SEARCH, candidates)),))
+    else:
+        cursor.execute("SELECT set_config('ivfflat.probes', %s, true)", (str(IVFFLAT_PROBES),))
+
+def search_parameters(n_results: int, search_mode: str) -> dict:
+    return {
+        "n_results": n_results,
+        "ann_candidates": max(ANN_CANDIDATES, n_results, HYBRID_CANDIDATES if search_mode == "hybrid" else 0),
+        "candidates": max(HYBRID_CANDIDATES, n_results),
+        "vector_weight": HYBRID_VECTOR_WEIGHT,
+        "text_weight": HYBRID_TEXT_WEIGHT,
+        "rrf_k": HYBRID_RRF_K,
+    }
+
+def run_search(name: str, search: tuple, values: dict) -> List[dict]:
+    statement, param_names = search
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            if ANN_MODE != "exact":
+                apply_ann_search_settings(cursor, values["ann_candidates"])
+            execute_prepared(
+                cursor, name, statement,
+                tuple(values[param] for param in param_names),
+                placeholders=", ".join(SEARCH_PARAM_PLACEHOLDERS.get(param, "%s") for param in param_names)
+            )
+            columns = [column.name for column in cursor.description]
+            rows = cursor.fetchall()
+    return [dict(zip(columns, row)) for row in rows]
+
+@timed("search")
+def search_chunks(query: str, n_results: int = 5, query_embedding: Optional[List[float]] = None,
+                  search_mode: Optional[str] = None) -> List[dict]:
+    search_mode = search_mode or SEARCH_MODE
+    try:
+        if query_embedding is None:
+            query_embedding = embed_query(query)
+        values = dict(search_parameters(n_results, search_mode), embedding=query_embedding, query_text=query)
+        return run_search(f"search_chunks_{search_mode}", SEARCH_STATEMENTS[search_mode], values)
+    except psycopg2.errors.UndefinedColumn as e:
+        if search_mode != "hybrid":
+            raise
+        # chunks.tsv is set up by the worker, and only with SEARCH_MODE=hybrid.
+        logger.warning(f"Full-text search is not set up ({e}); falling back to vector search.")
+        return search_chunks(query, n_results, query_embedding, "vector")
     except psycopg2.Error as e:
         logger.error(f"Database error during chunk search: {e}")
         return []
-    finally:
-        if conn:
-            cursor.close()
-            conn.close()
 
-def query_rag(query: str, n_results: int = 5) -> str:
+def vector_literal(embedding) -> str:
+    return "[" + ",".join(map(str, np.asarray(embedding, dtype=np.float32).tolist())) + "]"
+
+@timed("search_batch")
+def search_chunks_batch(queries: List[str], n_results: int = 5, query_embeddings: Optional[list] = None,
+                        search_mode: Optional[str] = None) -> List[List[dict]]:
+    """Runs search_chunks for every query in a single statement. Returns one result list per query, in order."""
+    search_mode = search_mode or SEARCH_MODE
+    if not queries:
+        return []
+    if query_embeddings is None:
+        query_embeddings = embed_queries(queries)
+    values = dict(
+        search_parameters(n_results, search_mode),
+        # Sent as vector literals: psycopg2 would send a list of vectors as a 2-D float array.
+        embeddings=[vector_literal(embedding) for embedding in query_embeddings],
+        query_texts=list(queries)
+    )
+    results = [[] for _ in queries]
+    try:
+        rows = run_search(f"search_chunks_batch_{search_mode}", BATCH_SEARCH_STATEMENTS[search_mode], values)
+    except psycopg2.errors.UndefinedColumn as e:
+        if search_mode != "hybrid":
+            raise
+        logger.warning(f"Full-text search is not set up ({e}); falling back to vector search.")
+        return search_chunks_batch(queries, n_results, query_embeddings, "vector")
+    except psycopg2.Error as e:
+        logger.error(f"Database error during batch chunk search: {e}")
+        return results
+    for row in rows:
+        results[row.pop("query_index")].append(row)
+    return results
+
+NO_RESULTS_MESSAGE = "I am Cerince, your friendly assistant. I couldn't find any relevant information in the documents to answer your question."
+SYSTEM_MESSAGE = (
+    "You are Cerince, a friendly AI assistant specializing in providing information about menstruation and cervix when relevant. "
+    "Answer the user's question based *only* on the provided context. If the context lacks sufficient information, clearly state that. "
+    "Cite your sources by referencing the document name, page numbers, or section titles from the context. Be concise, accurate, and friendly."
+)
+COMPLETION_MAX_TOKENS = 700
+COMPLETION_TEMPERATURE = 0.5
+
+# --- Context Assembly ---
+def _shingles(text: str, size: int = 3) -> set:
+    words = text.casefold().split()
+    return {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+def deduplicate_chunks(ranked_chunks: List[dict], threshold: float) -> List[dict]:
+    kept, kept_shingles = [], []
+    for chunk in ranked_chunks:
+        shingles = _shingles(chunk["text"])
+        if any(len(shingles & other) / (len(shingles | other) or 1) >= threshold for other in kept_shingles):
+            continue
+        kept.append(chunk)
+        kept_shingles.append(shingles)
+    return kept
+
+def merge_adjacent_chunks(ranked_chunks: List[dict]) -> List[dict]:
+    """Joins hits with consecutive chunk_index from the same document into one passage.
+
+    A passage takes the rank of its best chunk, so the returned list is still best first.
+    """
+    groups = {}
+    for rank, chunk in enumerate(ranked_chunks):
+        groups.setdefault((chunk.get("doc_id"), chunk.get("source_type")), []).append((rank, chunk))
+    passages = []
+    for members in groups.values():
+        members.sort(key=lambda member: member[1].get("chunk_index") or 0)
+        run = [members[0]]
+        for member in members[1:]:
+            if member[1].get("chunk_index") == run[-1][1].get("chunk_index", -2) + 1:
+                run.append(member)
+            else:
+                passages.append(run)
+                run = [member]
+        passages.append(run)
+    merged = []
+    for run in passages:
+        best_rank, best = min(run, key=lambda member: member[0])
+        chunks = [chunk for _, chunk in run]
+        pages = sorted({page for chunk in chunks for page in (chunk.get("page_numbers") or [])})
+        merged.append((best_rank, {
+            **{key: value for key, value in best.items() if key != "text"},
+            "chunk_index": chunks[0].get("chunk_index"),
+            "chunk_indexes": [chunk.get("chunk_index") for chunk in chunks],
+            "page_numbers": pages or None,
+            "title": chunks[0].get("title") or best.get("title"),
+            "text": "\n".join(chunk["text"] for chunk in chunks),
+        }))
+    return [passage for _, passage in sorted(merged, key=lambda item: item[0])]
+
+def format_context_block(res: dict) -> str:
+    source_info_parts = []
+    if res.get("doc_name"):
+        source_info_parts.append(f"Document: '{res['doc_name']}' ({res.get('source_type', 'unknown source')})")
+    if res.get("page_numbers"):
+        source_info_parts.append(f"Pages: {', '.join(map(str, res['page_numbers']))}")
+    if res.get("title"):
+        source_info_parts.append(f"Section: '{res['title']}'")
+    source_info = " | ".join(filter(None, source_info_parts))
+    return f"Context from {source_info}:\n{res['text']}\n---"
+
+def build_rag_messages(query: str, relevant_chunks: List[dict], token_budget: int = CONTEXT_TOKEN_BUDGET):
+    """Builds the completion prompt from ranked chunks within `token_budget` prompt tokens.
+
+    Near-duplicates are dropped and neighbouring chunks merged before the budget is applied; the
+    budget is then filled best-ranked first, so the lowest-ranked material is truncated or left
+    out. Returns the messages, the passages that made it in, and token counts for the request.
+    """
+    passages = merge_adjacent_chunks(deduplicate_chunks(relevant_chunks, CONTEXT_DEDUP_THRESHOLD))
+    question = f"User Question: {query}\n\nProvided Context:\n"
+    # Each chat message costs a few tokens of framing on top of its content.
+    overhead = chat_tokenizer.count_tokens(SYSTEM_MESSAGE) + chat_tokenizer.count_tokens(question) + 11
+    remaining = token_budget - overhead
+    separator_tokens = chat_tokenizer.count_tokens("\n\n")
+    blocks, used, truncated = [], [], 0
+    for passage in passages:
+        block = format_context_block(passage)
+        cost = chat_tokenizer.count_tokens(block) + (separator_tokens if blocks else 0)
+        if cost > remaining:
+            header_cost = cost - chat_tokenizer.count_tokens(passage["text"])
+            available = remaining - header_cost
+            if available < CONTEXT_MIN_PASSAGE_TOKENS:
+                break
+            passage = dict(passage, text=chat_tokenizer.decode(chat_tokenizer.encode(passage["text"])[:available]))
+            block = format_context_block(passage)
+            cost = chat_tokenizer.count_tokens(block) + (separator_tokens if blocks else 0)
+            truncated += 1
+        blocks.append(block)
+        used.append(passage)
+        remaining -= cost
+        if truncated:
+            break
+    context_str = "\n\n".join(blocks)
+    logger.debug(f"Context provided to LLM:\n{context_str}")
+    messages = [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": f"{question}{context_str}"}
+    ]
+    usage = {
+        "prompt_tokens_estimate": token_budget - remaining,
+        "context_tokens": token_budget - remaining - overhead,
+        "token_budget": token_budget,
+        "chunks_retrieved": len(relevant_chunks),
+        "passages_built": len(passages),
+        "passages_used": len(used),
+        "passages_truncated": truncated,
+    }
+    return messages, used, usage
+
+def format_sources(relevant_chunks: List[dict]) -> List[dict]:
+    # Everything but the chunk text, which the client does not need to render citations.
+    return [{key: value for key, value in res.items() if key != "text"} for res in relevant_chunks]
+
+@timed("rag")
+def query_rag(query: str, n_results: int = 5, use_cache: bool = True, search_mode: Optional[str] = None) -> dict:
+    """Answers `query` from the corpus. Returns the answer as "response" plus token "usage" counts."""
+    search_mode = search_mode or SEARCH_MODE
     try:
-        relevant_chunks = search_chunks(query, n_results)
+        query_embedding = embed_query(query)
+        corpus_version = get_corpus_version()
+        if use_cache and corpus_version is not None:
+            cached = answer_cache.lookup(query_embedding, (n_results, search_mode), corpus_version)
+            if cached is not None:
+                logger.info("Answer served from semantic cache.")
+                return {"response": cached["answer"], "usage": {"cached": True}}
+        relevant_chunks = search_chunks(query, n_results, query_embedding=query_embedding, search_mode=search_mode)
         if not relevant_chunks:
-            return "I am Cerince, your friendly assistant. I couldn't find any relevant information in the documents to answer your question."
-        context = []
-        for res in relevant_chunks:
-            source_info_parts = []
-            if res.get("doc_name"):
-                source_info_parts.append(f"Document: '{res['doc_name']}' ({res.get('source_type', 'unknown source')})")
-            if res.get("page_numbers"):
-                source_info_parts.append(f"Pages: {', '.join(map(str, res['page_numbers']))}")
-            if res.get("title"):
-                source_info_parts.append(f"Section: '{res['title']}'")
-            source_info = " | ".join(filter(None, source_info_parts))
-            context.append(f"Context from {source_info}:\n{res['text']}\n---")
-        context_str = "\n\n".join(context)
-        system_message = (
-            "You are Cerince, a friendly AI assistant specializing in providing information about menstruation and cervix when relevant. "
-            "Answer the user's question based *only* on the provided context. If the context lacks sufficient information, clearly state that. "
-            "Cite your sources by referencing the document name, page numbers, or section titles from the context. Be concise, accurate, and friendly."
+            return {"response": NO_RESULTS_MESSAGE, "usage": None}
+        with stage_timer("context"):
+            messages, passages, usage = build_rag_messages(query, relevant_chunks)
+        with stage_timer("completion"):
+            response = client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                max_tokens=COMPLETION_MAX_TOKENS,
+                temperature=COMPLETION_TEMPERATURE
+            )
+        answer = response.choices[0].message.content
+        if response.usage:
+            usage.update(prompt_tokens=response.usage.prompt_tokens, completion_tokens=response.usage.completion_tokens)
+            record_tokens(CHAT_MODEL, prompt=response.usage.prompt_tokens, completion=response.usage.completion_tokens)
+        logger.info(f"Completion token usage: {usage}")
+        if corpus_version is not None:
+            answer_cache.store(
+                query_embedding, (n_results, search_mode), corpus_version,
+                {"answer": answer, "sources": format_sources(passages)}
+            )
+        return {"response": answer, "usage": usage}
+    except Exception as e:
+        logger.error(f"Error querying RAG: {e}")
+        return {"response": f"I am Cerince, your friendly assistant. An error occurred: {e}", "usage": None}
+
+async def query_rag_batch(queries: List[str], n_results: int = 5, use_cache: bool = True,
+                          search_mode: Optional[str] = None) -> List[dict]:
+    """Answers many queries with one embeddings request and one search round trip.
+
+    Completions then run concurrently, at most BATCH_COMPLETION_CONCURRENCY at a time. Results come
+    back in the order of `queries`, each shaped like query_rag's; a failed completion only affects
+    its own query.
+    """
+    search_mode = search_mode or SEARCH_MODE
+    with stage_timer("rag_batch"):
+        try:
+            query_embeddings = await run_in_threadpool(embed_queries, queries)
+            corpus_version = await run_in_threadpool(get_corpus_version)
+        except Exception as e:
+            logger.error(f"Error embedding batch queries: {e}")
+            return [{"response": f"I am Cerince, your friendly assistant. An error occurred: {e}", "usage": None}
+                    for _ in queries]
+        results = [None] * len(queries)
+        if use_cache and corpus_version is not None:
+            for i, query_embedding in enumerate(query_embeddings):
+                cached = answer_cache.lookup(query_embedding, (n_results, search_mode), corpus_version)
+                if cached is not None:
+                    results[i] = {"response": cached["answer"], "usage": {"cached": True}}
+        pending = [i for i, result in enumerate(results) if result is None]
+        logger.info(f"Batch of {len(queries)} queries: {len(queries) - len(pending)} answered from cache.")
+        relevant_chunks = await run_in_threadpool(
+            search_chunks_batch, [queries[i] for i in pending], n_results,
+            [query_embeddings[i] for i in pending], search_mode
         )
-        logger.debug(f"Context provided to LLM:\n{context_str}")
-        response = client.chat.completions.create(
+        semaphore = asyncio.Semaphore(BATCH_COMPLETION_CONCURRENCY)
+
+        async def answer(i: int, chunks: List[dict]):
+            if not chunks:
+                results[i] = {"response": NO_RESULTS_MESSAGE, "usage": None}
+                return
+            try:
+                messages, passages, usage = await run_in_threadpool(build_rag_messages, queries[i], chunks)
+                async with semaphore:
+                    with stage_timer("completion"):
+                        response = await async_client.chat.completions.create(
+                            model=CHAT_MODEL,
+                            messages=messages,
+                            max_tokens=COMPLETION_MAX_TOKENS,
+                            temperature=COMPLETION_TEMPERATURE
+                        )
+                answer = response.choices[0].message.content
+                if response.usage:
+                    usage.update(prompt_tokens=response.usage.prompt_tokens, completion_tokens=response.usage.completion_tokens)
+                    record_tokens(CHAT_MODEL, prompt=response.usage.prompt_tokens, completion=response.usage.completion_tokens)
+                if corpus_version is not None:
+                    answer_cache.store(
+                        query_embeddings[i], (n_results, search_mode), corpus_version,
+                        {"answer": answer, "sources": format_sources(passages)}
+                    )
+                results[i] = {"response": answer, "usage": usage}
+            except Exception as e:
+                logger.error(f"Error answering batch query {i}: {e}")
+                results[i] = {"response": f"I am Cerince, your friendly assistant. An error occurred: {e}", "usage": None}
+
+        await asyncio.gather(*(answer(i, chunks) for i, chunks in zip(pending, relevant_chunks)))
+        return results
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def stream_rag(query: str, n_results: int = 5, use_cache: bool = True, search_mode: Optional[str] = None):
+    """Yields Server-Sent Events: `sources` first, then `token` events as the answer streams, then `done`."""
+    search_mode = search_mode or SEARCH_MODE
+    try:
+        # Embedding lookup and retrieval use blocking clients, so they run in the threadpool.
+        query_embedding = await run_in_threadpool(embed_query, query)
+        corpus_version = await run_in_threadpool(get_corpus_version)
+        if use_cache and corpus_version is not None:
+            cached = answer_cache.lookup(query_embedding, (n_results, search_mode), corpus_version)
+            if cached is not None:
+                logger.info("Streaming answer from semantic cache.")
+                yield sse_event("sources", {"sources": cached["sources"], "cached": True})
+                yield sse_event("token", {"content": cached["answer"]})
+                yield sse_event("done", {"cached": True})
+                return
+        relevant_chunks = await run_in_threadpool(search_chunks, query, n_results, query_embedding, search_mode)
+        if not relevant_chunks:
+            yield sse_event("sources", {"sources": [], "cached": False})
+            yield sse_event("token", {"content": NO_RESULTS_MESSAGE})
+            yield sse_event("done", {"cached": False})
+            return
+        messages, passages, usage = await run_in_threadpool(build_rag_messages, query, relevant_chunks)
+        yield sse_event("sources", {"sources": format_sources(passages), "cached": False})
+        started = time.perf_counter()
+        stream = await async_client.chat.completions.create(
             model=CHAT_MODEL,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": f"User Question: {query}\n\nProvided Context:\n{context_str}"}
-            ],
-            max_tokens=700,
-            temperature=0.5
+            messages=messages,
+            max_tokens=COMPLETION_MAX_TOKENS,
+            temperature=COMPLETION_TEMPERATURE,
+            stream=True,
+            stream_options={"include_usage": True}
         )
-        return response.choices[0].message.content
+        answer_parts = []
+        async with stream:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not answer_parts:
+                        observe_stage("completion_first_token", time.perf_counter() - started)
+                    answer_parts.append(chunk.choices[0].delta.content)
+                    yield sse_event("token", {"content": chunk.choices[0].delta.content})
+                if chunk.usage:
+                    usage.update(prompt_tokens=chunk.usage.prompt_tokens, completion_tokens=chunk.usage.completion_tokens)
+                    record_tokens(CHAT_MODEL, prompt=chunk.usage.prompt_tokens, completion=chunk.usage.completion_tokens)
+        observe_stage("completion", time.perf_counter() - started)
+        if corpus_version is not None:
+            answer_cache.store(
+                query_embedding, (n_results, search_mode), corpus_version,
+                {"answer": "".join(answer_parts), "sources": format_sources(passages)}
+            )
+        yield sse_event("done", {"cached": False, "usage": usage})
     except Exception as e:
-        logger.error(f"Error querying RAG: {e}")
-        return f"I am Cerince, your friendly assistant. An error occurred: {e}"
+        logger.error(f"Error streaming RAG response: {e}")
+        yield sse_event("error", {"detail": f"An error occurred: {e}"})
 
 # --- FastAPI Endpoints ---
 class QueryRequest(BaseModel):
     query: str
     n_results: int = Field(5, ge=1, le=20)
+    search_mode: Optional[str] = Field(None, pattern="^(vector|hybrid)$")  # Defaults to SEARCH_MODE
+    use_cache: bool = True  # Set to false to skip the semantic answer cache for this request
 
 class QueryResponse(BaseModel):
     response: str
     retrieved_chunks: Optional[List[dict]] = None
+    usage: Optional[dict] = None  # Prompt/context/completion token counts for this request
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_QUERIES)
+    n_results: int = Field(5, ge=1, le=20)
+    search_mode: Optional[str] = Field(None, pattern="^(vector|hybrid)$")
+    use_cache: bool = True
+
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]  # One per query, in request order
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_QUERIES)
+    n_results: int = Field(5, ge=1, le=20)
+    search_mode: Optional[str] = Field(None, pattern="^(vector|hybrid)$")
+
+class BatchSearchResponse(BaseModel):
+    results: List[List[dict]]  # Retrieved chunks per query, in request order
 
 class ProcessRequest(BaseModel):
     source_type: str = Field("google_drive", pattern="^(google_drive|local)$")
@@ -357,38 +2202,100 @@ class ProcessRequest(BaseModel):
 class ProcessResponse(BaseModel):
     status: str
     message: Optional[str] = None
-    processed_files: Optional[List[str]] = None
+    job_id: Optional[int] = None
+
+class IngestJobResponse(BaseModel):
+    job_id: int
+    status: str
+    request: dict
+    summary: Optional[dict] = None  # files_skipped/added/updated/removed/failed etc. once finished
+    error: Optional[str] = None
+    attempts: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    file_counts: dict  # Per-file status -> count, updated while the job runs
+
+class IngestJobFile(BaseModel):
+    doc_id: str
+    doc_name: Optional[str] = None
+    status: str
+    chunks: Optional[int] = None
+    embedded: Optional[int] = None
+    seconds: Optional[float] = None
+    timings: Optional[dict] = None
+    error: Optional[str] = None
+    updated_at: datetime
 
 @app.post("/chat", response_model=QueryResponse)
 async def chat_endpoint(request: QueryRequest, user: dict = Depends(get_current_user)):
     logger.info(f"Received query: '{request.query}' with n_results={request.n_results}")
-    response_text = query_rag(request.query, request.n_results)
+    # query_rag does blocking OpenAI and database I/O, so keep it off the event loop.
+    result = await run_in_threadpool(
+        query_rag, request.query, request.n_results, request.use_cache, request.search_mode
+    )
     logger.info(f"RAG response generated.")
-    return QueryResponse(response=response_text)
+    return QueryResponse(**result)
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: QueryRequest, user: dict = Depends(get_current_user)):
+    logger.info(f"Received streaming query: '{request.query}' with n_results={request.n_results}")
+    return StreamingResponse(
+        stream_rag(request.query, request.n_results, request.use_cache, request.search_mode),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/chat/batch", response_model=BatchQueryResponse)
+async def chat_batch_endpoint(request: BatchQueryRequest, user: dict = Depends(get_current_user)):
+    logger.info(f"Received batch of {len(request.queries)} queries with n_results={request.n_results}")
+    results = await query_rag_batch(request.queries, request.n_results, request.use_cache, request.search_mode)
+    return BatchQueryResponse(results=[QueryResponse(**result) for result in results])
+
+@app.post("/search/batch", response_model=BatchSearchResponse)
+async def search_batch_endpoint(request: BatchSearchRequest, user: dict = Depends(get_current_user)):
+    logger.info(f"Received batch search of {len(request.queries)} queries with n_results={request.n_results}")
+    try:
+        results = await run_in_threadpool(
+            search_chunks_batch, request.queries, request.n_results, None, request.search_mode
+        )
+    except Exception as e:
+        logger.error(f"Error in batch search: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {e}")
+    return BatchSearchResponse(results=results)
 
 @app.post("/process", response_model=ProcessResponse)
 async def process_endpoint(request: ProcessRequest, user: dict = Depends(get_current_user)):
     logger.info(f"Processing request: {request.model_dump_json()}")
+    if request.source_type == "local" and not request.local_folder_path:
+        raise HTTPException(status_code=400, detail="local_folder_path required.")
+    if request.source_type == "google_drive" and not request.google_drive_folder_id:
+        raise HTTPException(status_code=400, detail="google_drive_folder_id required.")
+    # Ingestion runs in worker.py; the API only queues the job.
     try:
-        if request.source_type == "local" and not request.local_folder_path:
-            raise HTTPException(status_code=400, detail="local_folder_path required.")
-        if request.source_type == "google_drive" and not request.google_drive_folder_id:
-            raise HTTPException(status_code=400, detail="google_drive_folder_id required.")
-        process_documents(
-            source_type=request.source_type,
-            google_drive_folder_id=request.google_drive_folder_id,
-            local_folder_path=request.local_folder_path
-        )
-        return ProcessResponse(status="success", message="Documents processed successfully.")
-    except FileNotFoundError as e:
-        logger.error(f"File not found: {e}")
-        raise HTTPException(status_code=404, detail=str(e))
-    except ValueError as e:
-        logger.error(f"Value error: {e}")
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        logger.error(f"Error processing documents: {e}", exc_info=True)
+        job_id = await run_in_threadpool(enqueue_ingest_job, request.model_dump())
+    except psycopg2.Error as e:
+        logger.error(f"Error queueing ingestion job: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Unexpected error: {e}")
+    return ProcessResponse(status="queued", message="Ingestion job queued.", job_id=job_id)
+
+@app.get("/process/{job_id}", response_model=IngestJobResponse)
+async def process_status_endpoint(job_id: int, user: dict = Depends(get_current_user)):
+    job = await run_in_threadpool(get_ingest_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return IngestJobResponse(**job)
+
+@app.get("/process/{job_id}/files", response_model=List[IngestJobFile])
+async def process_files_endpoint(job_id: int, user: dict = Depends(get_current_user)):
+    if await run_in_threadpool(get_ingest_job, job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return [IngestJobFile(**f) for f in await run_in_threadpool(list_ingest_job_files, job_id)]
+
+@app.get("/stats")
+async def stats_endpoint(user: dict = Depends(get_current_user)):
+    return cache_stats()
 
 @app.get("/")
 async def root():
@@ -399,7 +2306,13 @@ async def root():
 async def startup_event():
     logger.info("Application startup...")
     try:
+        init_db_pool()
         setup_postgres()
         logger.info("PostgreSQL connection verified.")
     except Exception as e:
-        logger.error(f"Failed to initialize PostgreSQL: {e}")
\ No newline at end of file
+        logger.error(f"Failed to initialize PostgreSQL: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    logger.info("Application shutdown...")
+    close_db_pool()
\ No newline at end of file
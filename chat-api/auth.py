@@ -1,9 +1,16 @@
 import os
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
 import httpx
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import jwt, jwk
 from jose.exceptions import JWTError, ExpiredSignatureError, JWTClaimsError
+from metrics import stage_timer
 
 # --- Auth0 Configuration ---
 # These values will be pulled from environment variables.
@@ -12,9 +19,110 @@ AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
 # This is the 'Identifier' of your API in the Auth0 Dashboard.
 API_AUDIENCE = os.getenv("API_AUDIENCE")
 ALGORITHMS = ["RS256"]
+# Overrides the JWKS location derived from AUTH0_DOMAIN, e.g. to use the local issuer in fakes.py.
+AUTH0_JWKS_URL = os.getenv("AUTH0_JWKS_URL")
 
-# A dictionary to cache the JWKS (JSON Web Key Set)
-jwks = {}
+# --- Key Cache Configuration ---
+JWKS_CACHE_TTL = float(os.getenv("JWKS_CACHE_TTL", "3600"))  # Seconds before the JWKS is fetched again
+# An unknown 'kid' triggers an early refresh (Auth0 rotated its keys), but at most this often.
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv("JWKS_MIN_REFRESH_INTERVAL", "30"))
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", "1024"))
+
+logger = logging.getLogger(__name__)
+
+class JWKSKeyStore:
+    """Signing keys from the JWKS endpoint, indexed by 'kid' and constructed once per refresh."""
+
+    def __init__(self, jwks_url: str, algorithm: str, ttl: float, min_refresh_interval: float):
+        self.jwks_url = jwks_url
+        self.algorithm = algorithm
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.keys = {}
+        self.fetched_at = None
+        self.last_attempt = None
+        self.refreshes = 0
+        self._generation = 0  # Incremented after every refresh attempt, successful or not
+        self._lock = asyncio.Lock()
+        self._client = None
+
+    def _is_stale(self) -> bool:
+        return self.fetched_at is None or time.monotonic() - self.fetched_at > self.ttl
+
+    def _may_refresh_early(self) -> bool:
+        return self.last_attempt is None or time.monotonic() - self.last_attempt >= self.min_refresh_interval
+
+    async def refresh(self):
+        generation = self._generation
+        async with self._lock:
+            # Single flight: if another request refreshed while we waited for the lock, use its result.
+            if self._generation != generation:
+                return
+            try:
+                await self._fetch()
+            finally:
+                self._generation += 1
+
+    async def _fetch(self):
+        self.last_attempt = time.monotonic()
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=10)
+        try:
+            response = await self._client.get(self.jwks_url)
+            response.raise_for_status()
+            keys = {
+                key["kid"]: jwk.construct(key, algorithm=self.algorithm)
+                for key in response.json()["keys"]
+                if key.get("kid") and key.get("use", "sig") == "sig"
+            }
+        except Exception as e:
+            if not self.keys:
+                raise
+            # Keep serving the keys we have; Auth0 being briefly unreachable should not break auth.
+            logger.warning(f"JWKS refresh failed, keeping {len(self.keys)} cached keys: {e}")
+            return
+        self.keys = keys
+        self.fetched_at = time.monotonic()
+        self.refreshes += 1
+        logger.info(f"Loaded {len(keys)} signing keys from JWKS.")
+
+    async def get_key(self, kid: str):
+        if self._is_stale() and (not self.keys or self._may_refresh_early()):
+            await self.refresh()
+        key = self.keys.get(kid)
+        if key is None and self._may_refresh_early():
+            await self.refresh()
+            key = self.keys.get(kid)
+        return key
+
+class VerifiedTokenCache:
+    """Bounded LRU of decoded token payloads, each valid until the token's own 'exp'."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        payload = self._data.get(key)
+        if payload is None:
+            return None
+        if payload.get("exp", 0) <= time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return payload
+
+    def set(self, token: str, payload: dict):
+        if self.maxsize <= 0 or "exp" not in payload:
+            return
+        self._data[self._key(token)] = payload
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
 
 class VerifyToken:
     """Does all the token verification using PyJWT"""
@@ -23,21 +131,23 @@ class VerifyToken:
         self.auth0_domain = AUTH0_DOMAIN
         self.api_audience = API_AUDIENCE
         self.algorithms = ALGORITHMS
-        self.jwks_url = f"https://{self.auth0_domain}/.well-known/jwks.json"
-
-    async def get_jwks(self):
-        global jwks
-        if not jwks:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(self.jwks_url)
-                response.raise_for_status()
-                jwks = response.json()
-        return jwks
+        self.jwks_url = AUTH0_JWKS_URL or f"https://{self.auth0_domain}/.well-known/jwks.json"
+        self.key_store = JWKSKeyStore(self.jwks_url, self.algorithms[0], JWKS_CACHE_TTL, JWKS_MIN_REFRESH_INTERVAL)
+        self.verified_tokens = VerifiedTokenCache(VERIFIED_TOKEN_CACHE_SIZE)
 
     async def verify(self, token: HTTPAuthorizationCredentials = Security(HTTPBearer())):
+        with stage_timer("auth"):
+            return await self._verify(token)
+
+    async def _verify(self, token: HTTPAuthorizationCredentials):
         if token is None:
             raise HTTPException(status_code=401, detail="Unauthorized: No token provided")
-        
+
+        # A token that already passed verification is good until it expires.
+        payload = self.verified_tokens.get(token.credentials)
+        if payload is not None:
+            return payload
+
         try:
             unverified_header = jwt.get_unverified_header(token.credentials)
         except JWTError:
@@ -47,24 +157,23 @@ class VerifyToken:
         if not kid:
             raise HTTPException(status_code=401, detail="Unauthorized: Missing 'kid' in token header")
 
-        signing_key = None
-        jwks_keys = await self.get_jwks()
-        for key in jwks_keys["keys"]:
-            if key["kid"] == kid:
-                signing_key = jwk.construct(key, algorithm=self.algorithms[0])
-                break
-        
+        try:
+            signing_key = await self.key_store.get_key(kid)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Could not fetch signing keys: {e}")
+
         if not signing_key:
             raise HTTPException(status_code=401, detail="Unauthorized: Could not find appropriate signing key")
 
         try:
             payload = jwt.decode(
                 token.credentials,
-                signing_key.to_pem(),
+                signing_key,
                 algorithms=self.algorithms,
                 audience=self.api_audience,
                 issuer=f"https://{self.auth0_domain}/"
             )
+            self.verified_tokens.set(token.credentials, payload)
             return payload
         except ExpiredSignatureError:
             raise HTTPException(status_code=401, detail="Token has expired")
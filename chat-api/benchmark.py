@@ -0,0 +1,397 @@
+"""End-to-end benchmarks for /chat latency and ingestion throughput, against the local fakes in fakes.py.
+
+OpenAI, Google Drive and Auth0 are replaced by fakes.py servers; Postgres must be a real pgvector
+instance, e.g. `docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=bench pgvector/pgvector:pg16`.
+The benchmark creates and wipes its own database (--database, "chat_bench" by default), so it never
+touches the application's data. The API runs under gunicorn exactly as in the dockerfile.
+
+    POSTGRES_PASSWORD=bench python benchmark.py --output results.json
+    POSTGRES_PASSWORD=bench python benchmark.py --baseline results.json  # exits 1 on regression
+
+Results are JSON: per (corpus size, concurrency) p50/p95/p99 latency and requests/s for /chat, and
+files/s and chunks/s for a cold ingestion and for a re-sync of unchanged files.
+"""
+import os
+import sys
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import List
+
+import httpx
+import psycopg2
+from psycopg2 import sql
+
+import fakes
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+VOCABULARY = (
+    "invoice contract payment policy employee leave travel expense budget quarter revenue forecast "
+    "customer support ticket escalation warranty refund shipping delivery supplier inventory audit "
+    "compliance security password access laptop onboarding training benefit insurance pension salary "
+    "meeting agenda project milestone deadline release roadmap feature requirement design review "
+    "server database backup incident outage latency deployment pipeline report analysis summary"
+).split()
+
+# --- Helpers ---
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+def random_sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
+
+def synthetic_pdf(pages: List[List[str]]) -> bytes:
+    """A minimal text PDF, one list of lines per page, that Docling can convert without OCR."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for lines in pages:
+        text = "".join(f"({line.replace(chr(92), '').replace('(', '').replace(')', '')}) '\n" for line in lines)
+        stream = f"BT /F1 11 Tf 14 TL 72 770 Td\n{text}ET".encode("latin-1")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream.decode('latin-1')}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>"
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return bytes(out)
+
+# --- Environment ---
+def ensure_database(args):
+    conn = psycopg2.connect(
+        dbname="postgres", user=args.pg_user, password=args.pg_password, host=args.pg_host, port=args.pg_port
+    )
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (args.database,))
+            if cursor.fetchone() is None:
+                cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(args.database)))
+    finally:
+        conn.close()
+
+def start_fakes(args) -> dict:
+    openai = fakes.FakeOpenAI(
+        embedding_latency=args.embedding_latency, embedding_latency_per_input=args.embedding_latency_per_input,
+        completion_latency=args.completion_latency, token_latency=args.token_latency,
+        completion_tokens=args.completion_tokens
+    )
+    auth0 = fakes.FakeAuth0(audience="chat-api-benchmark")
+    drive_root = tempfile.mkdtemp(prefix="bench-drive-")
+    drive = fakes.FakeDrive(drive_root)
+    servers = {
+        "openai": fakes.start_server(fakes.make_openai_handler(openai)),
+        "auth0": fakes.start_server(fakes.make_auth0_handler(auth0)),
+        "drive": fakes.start_server(fakes.make_drive_handler(drive)),
+    }
+    port = {name: server.server_address[1] for name, server in servers.items()}
+    # Set before app is imported, here and in the API subprocess, since its configuration is read at import.
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{port['openai']}/v1",
+        "GOOGLE_DRIVE_API_ENDPOINT": f"http://127.0.0.1:{port['drive']}/drive/v3/",
+        "AUTH0_DOMAIN": auth0.domain,
+        "API_AUDIENCE": auth0.audience,
+        "AUTH0_JWKS_URL": f"http://127.0.0.1:{port['auth0']}/.well-known/jwks.json",
+        "POSTGRES_DB": args.database,
+        "POSTGRES_USER": args.pg_user,
+        "POSTGRES_PASSWORD": args.pg_password,
+        "POSTGRES_HOST": args.pg_host,
+        "POSTGRES_PORT": str(args.pg_port),
+    })
+    return {"openai": openai, "auth0": auth0, "drive": drive, "drive_root": drive_root, "servers": servers}
+
+def start_api(args) -> tuple:
+    port = free_port()
+    command = [
+        # Everything else comes from gunicorn.conf.py, as in the container.
+        sys.executable, "-m", "gunicorn", "app:app", "--workers", str(args.workers),
+        "--bind", f"127.0.0.1:{port}", "--log-level", "warning",
+    ]
+    env = os.environ.copy()
+    if args.use_cache:
+        env["ANSWER_CACHE_ENABLED"] = "true"
+    process = subprocess.Popen(command, cwd=BENCHMARK_DIR, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API exited with code {process.returncode} during startup.")
+        try:
+            if httpx.get(f"{base_url}/", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("API did not become ready within 120s.")
+
+# --- Corpus ---
+def reset_corpus(chat_app):
+    with chat_app.get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("TRUNCATE chunks, documents")
+            chat_app.bump_corpus_version(cursor)
+        conn.commit()
+
+def grow_corpus(chat_app, target_size: int, words_per_chunk: int):
+    """Adds synthetic chunks until the table holds `target_size`, generating vectors in the database."""
+    with chat_app.get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM chunks")
+            current = cursor.fetchone()[0]
+            if current < target_size:
+                # The correlated `g.i IS NOT NULL` makes Postgres evaluate the subqueries once per row.
+                cursor.execute(f"""
+                    INSERT INTO chunks (doc_id, doc_name, chunk_index, text, embedding, filename, page_numbers, title, source_type)
+                    SELECT 'bench-' || (g.i / 50), 'Benchmark document ' || (g.i / 50), mod(g.i, 50),
+                           (SELECT string_agg((%(vocabulary)s::text[])[1 + floor(random() * %(vocabulary_size)s)::int], ' ')
+                            FROM generate_series(1, %(words)s) WHERE g.i IS NOT NULL),
+                           (SELECT array_agg(random() - 0.5)::vector({chat_app.EMBEDDING_DIMENSIONS})
+                            FROM generate_series(1, {chat_app.EMBEDDING_DIMENSIONS}) WHERE g.i IS NOT NULL),
+                           'bench-' || (g.i / 50) || '.pdf', ARRAY[1 + mod(g.i, 50) / 5], NULL, 'benchmark'
+                    FROM generate_series(%(start)s, %(stop)s) AS g(i)
+                """, {
+                    "vocabulary": list(VOCABULARY), "vocabulary_size": len(VOCABULARY), "words": words_per_chunk,
+                    "start": current, "stop": target_size - 1,
+                })
+            chat_app.bump_corpus_version(cursor)
+        conn.commit()
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE chunks")
+        conn.commit()
+
+# --- Benchmarks ---
+async def load_chat(base_url: str, token: str, args, concurrency: int, rng: random.Random) -> dict:
+    # Distinct questions, so neither the query embedding cache nor the answer cache can answer them.
+    questions = [f"{random_sentence(rng, 8)} {i}?" for i in range(args.requests + args.warmup)]
+    latencies, errors = [], 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, headers={"Authorization": f"Bearer {token}"}, limits=limits, timeout=120
+    ) as client:
+        async def ask(question: str) -> tuple:
+            started = time.perf_counter()
+            try:
+                response = await client.post("/chat", json={
+                    "query": question, "n_results": args.n_results, "use_cache": args.use_cache,
+                    **({"search_mode": args.search_mode} if args.search_mode else {}),
+                })
+                ok = response.status_code == 200 and "An error occurred" not in response.json().get("response", "")
+            except httpx.HTTPError:
+                ok = False
+            return time.perf_counter() - started, ok
+
+        for question in questions[:args.warmup]:
+            await ask(question)
+        pending = iter(questions[args.warmup:])
+
+        async def worker():
+            nonlocal errors
+            for question in pending:
+                elapsed, ok = await ask(question)
+                latencies.append(elapsed)
+                errors += not ok
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "requests_per_second": round(len(latencies) / wall, 2) if wall else 0.0,
+    }
+
+def bench_chat(chat_app, environment: dict, args) -> List[dict]:
+    rng = random.Random(args.seed)
+    token = environment["auth0"].issue_token(subject="benchmark")
+    process, base_url = start_api(args)
+    results = []
+    try:
+        reset_corpus(chat_app)
+        for corpus_size in sorted(args.corpus_sizes):
+            started = time.monotonic()
+            grow_corpus(chat_app, corpus_size, args.words_per_chunk)
+            print(f"Corpus at {corpus_size} chunks (seeded in {time.monotonic() - started:.1f}s).", file=sys.stderr)
+            for concurrency in args.concurrency:
+                result = asyncio.run(load_chat(base_url, token, args, concurrency, rng))
+                result["corpus_size"] = corpus_size
+                results.append(result)
+                print(f"  /chat x{concurrency}: {json.dumps(result)}", file=sys.stderr)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return results
+
+def bench_ingest(chat_app, environment: dict, args) -> List[dict]:
+    rng = random.Random(args.seed)
+    for i in range(args.ingest_files):
+        pages = [[random_sentence(rng, 12) for _ in range(args.lines_per_page)] for _ in range(args.pages_per_file)]
+        with open(os.path.join(environment["drive_root"], f"benchmark-{i:04d}.pdf"), "wb") as f:
+            f.write(synthetic_pdf(pages))
+    reset_corpus(chat_app)
+    # Like worker.py, convert with already-loaded models, so model loading is not part of the numbers.
+    chat_app.warm_converter_pool()
+    results = []
+    for run in ("cold", "unchanged"):
+        file_timings = []
+        progress = lambda updates: file_timings.extend(u["timings"] for u in updates if u.get("timings"))
+        started = time.perf_counter()
+        summary = chat_app.process_documents("google_drive", google_drive_folder_id="root", progress=progress)
+        wall = time.perf_counter() - started
+        chunks = summary["chunks_embedded"] + summary["chunks_reused"]
+        stages = sorted({stage for timings in file_timings for stage in timings})
+        result = {
+            "run": run,
+            "files": args.ingest_files,
+            "files_failed": summary["files_failed"],
+            "chunks": chunks,
+            "seconds": round(wall, 3),
+            "files_per_second": round(args.ingest_files / wall, 2),
+            "chunks_per_second": round(chunks / wall, 2),
+            "mean_stage_seconds": {
+                stage: round(sum(t.get(stage, 0.0) for t in file_timings) / len(file_timings), 4) for stage in stages
+            },
+        }
+        results.append(result)
+        print(f"Ingestion ({run}): {json.dumps(result)}", file=sys.stderr)
+    return results
+
+# --- Regression Check ---
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    previous_chat = {(r["corpus_size"], r["concurrency"]): r for r in baseline.get("chat", [])}
+    for r in results.get("chat", []):
+        before = previous_chat.get((r["corpus_size"], r["concurrency"]))
+        if not before:
+            continue
+        label = f"/chat corpus={r['corpus_size']} concurrency={r['concurrency']}"
+        if r["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {before['p95_ms']}ms -> {r['p95_ms']}ms")
+        if r["requests_per_second"] < before["requests_per_second"] * (1 - tolerance):
+            regressions.append(f"{label}: {before['requests_per_second']} -> {r['requests_per_second']} requests/s")
+        if r["errors"] > before["errors"]:
+            regressions.append(f"{label}: errors {before['errors']} -> {r['errors']}")
+    previous_ingest = {r["run"]: r for r in baseline.get("ingest", [])}
+    for r in results.get("ingest", []):
+        before = previous_ingest.get(r["run"])
+        if before and r["files_per_second"] < before["files_per_second"] * (1 - tolerance):
+            regressions.append(f"ingest {r['run']}: {before['files_per_second']} -> {r['files_per_second']} files/s")
+    return regressions
+
+def main():
+    int_list = lambda value: [int(v) for v in value.split(",") if v]
+    parser = argparse.ArgumentParser(description="Benchmark /chat and ingestion against local fakes.")
+    parser.add_argument("--pg-host", default=os.getenv("POSTGRES_HOST", "localhost"))
+    parser.add_argument("--pg-port", type=int, default=int(os.getenv("POSTGRES_PORT", "5432")))
+    parser.add_argument("--pg-user", default=os.getenv("POSTGRES_USER", "postgres"))
+    parser.add_argument("--pg-password", default=os.getenv("POSTGRES_PASSWORD", ""))
+    parser.add_argument("--database", default="chat_bench", help="Scratch database; wiped by the benchmark")
+    parser.add_argument("--corpus-sizes", type=int_list, default=[1000, 10000, 50000])
+    parser.add_argument("--concurrency", type=int_list, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Measured /chat requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers for the API")
+    parser.add_argument("--n-results", type=int, default=5)
+    parser.add_argument("--search-mode", choices=["vector", "hybrid"])
+    parser.add_argument("--use-cache", action="store_true", help="Let /chat use the semantic answer cache")
+    parser.add_argument("--words-per-chunk", type=int, default=200)
+    parser.add_argument("--ingest-files", type=int, default=20)
+    parser.add_argument("--pages-per-file", type=int, default=3)
+    parser.add_argument("--lines-per-page", type=int, default=40)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--embedding-latency-per-input", type=float, default=0.0005)
+    parser.add_argument("--completion-latency", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--skip-chat", action="store_true")
+    parser.add_argument("--skip-ingest", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results JSON here instead of stdout")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown before failing")
+    args = parser.parse_args()
+
+    ensure_database(args)
+    environment = start_fakes(args)
+    import app as chat_app
+    chat_app.init_db_pool()
+    chat_app.setup_postgres()
+    # The worker builds these in a deployment; the benchmark runs without one.
+    if chat_app.SEARCH_MODE == "hybrid" or args.search_mode == "hybrid":
+        chat_app.ensure_text_search_index()
+    if chat_app.ANN_MODE != "exact":
+        chat_app.ensure_ann_index()
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in ("pg_password", "output", "baseline")
+        },
+        "settings": {
+            "ann_mode": chat_app.ANN_MODE, "search_mode": args.search_mode or chat_app.SEARCH_MODE,
+            "embedding_dimensions": chat_app.EMBEDDING_DIMENSIONS, "context_token_budget": chat_app.CONTEXT_TOKEN_BUDGET,
+        },
+    }
+    try:
+        if not args.skip_ingest:
+            results["ingest"] = bench_ingest(chat_app, environment, args)
+        if not args.skip_chat:
+            results["chat"] = bench_chat(chat_app, environment, args)
+    finally:
+        chat_app.shutdown_converter_pool()
+        chat_app.close_db_pool()
+        for server in environment["servers"].values():
+            server.shutdown()
+    results["fake_requests"] = {
+        "openai": environment["openai"].requests, "drive": environment["drive"].requests,
+        "auth0": environment["auth0"].requests,
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""Local stand-ins for the external services the API talks to, for testing without real accounts.
+
+Run one from the command line, e.g. a fake Google Drive serving the contents of ./sample-docs:
+
+    python fakes.py drive --root ./sample-docs --port 8765
+
+then start the API or worker with GOOGLE_DRIVE_API_ENDPOINT=http://localhost:8765/drive/v3/ and
+use "root" as the Google Drive folder id. Likewise:
+
+    python fakes.py openai --port 8766   # OPENAI_BASE_URL=http://localhost:8766/v1
+    python fakes.py auth0 --port 8767    # AUTH0_JWKS_URL=http://localhost:8767/.well-known/jwks.json
+
+The auth0 fake prints a bearer token for AUTH0_DOMAIN/API_AUDIENCE matching its --domain/--audience.
+"""
+import os
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# --- Fake Google Drive ---
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+GOOGLE_DOC_MIME_TYPE = "application/vnd.google-apps.document"
+_PARENT_QUERY = re.compile(r"'([^']+)' in parents")
+
+class FakeDrive:
+    """Serves a local directory as a Drive folder tree through the subset of the Drive v3 API the app uses.
+
+    Subdirectories become folders and "root" is the id of the top directory. Files ending in ".gdoc"
+    are reported as Google Docs and their raw content is returned when exported. Listing is paginated
+    by `page_size` regardless of the requested pageSize, so pagination is always exercised.
+    """
+
+    def __init__(self, root: str, page_size: int = 100):
+        self.root = os.path.abspath(root)
+        self.page_size = page_size
+        self.requests = {"list": 0, "media": 0, "export": 0}
+        self._lock = threading.Lock()
+
+    def _id(self, relative_path: str) -> str:
+        return "root" if relative_path in ("", ".") else hashlib.sha1(relative_path.encode("utf-8")).hexdigest()[:20]
+
+    def _entries(self) -> dict:
+        # Re-scanned on every request so tests can add, change and remove files between syncs.
+        entries = {"root": {"path": self.root, "relative": "", "folder": True}}
+        for directory, subdirs, files in os.walk(self.root):
+            for name in subdirs + files:
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, self.root)
+                entries[self._id(relative)] = {
+                    "path": path, "relative": relative, "folder": name in subdirs,
+                    "parent": self._id(os.path.relpath(directory, self.root)),
+                }
+        return entries
+
+    def _metadata(self, file_id: str, entry: dict) -> dict:
+        name = os.path.basename(entry["path"])
+        stat = os.stat(entry["path"])
+        metadata = {
+            "id": file_id, "name": name,
+            "modifiedTime": datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat().replace("+00:00", "Z"),
+        }
+        if entry["folder"]:
+            metadata["mimeType"] = FOLDER_MIME_TYPE
+        elif name.endswith(".gdoc"):
+            metadata["name"] = name[:-len(".gdoc")]
+            metadata["mimeType"] = GOOGLE_DOC_MIME_TYPE
+        else:
+            metadata["mimeType"] = "application/pdf" if name.lower().endswith(".pdf") else "application/octet-stream"
+            with open(entry["path"], "rb") as f:
+                metadata["md5Checksum"] = hashlib.md5(f.read()).hexdigest()
+        return metadata
+
+    def list(self, query: str, page_token: str = None) -> dict:
+        self._count("list")
+        match = _PARENT_QUERY.search(query or "")
+        parent = match.group(1) if match else "root"
+        entries = self._entries()
+        children = sorted(
+            (file_id for file_id, entry in entries.items() if entry.get("parent") == parent),
+            key=lambda file_id: entries[file_id]["relative"]
+        )
+        start = int(page_token or 0)
+        page = children[start:start + self.page_size]
+        result = {"files": [self._metadata(file_id, entries[file_id]) for file_id in page]}
+        if start + self.page_size < len(children):
+            result["nextPageToken"] = str(start + self.page_size)
+        return result
+
+    def content(self, file_id: str, kind: str):
+        self._count(kind)
+        entry = self._entries().get(file_id)
+        if entry is None or entry["folder"]:
+            return None
+        with open(entry["path"], "rb") as f:
+            return f.read()
+
+    def _count(self, kind: str):
+        with self._lock:
+            self.requests[kind] += 1
+
+def make_drive_handler(drive: FakeDrive):
+    class DriveHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            parts = url.path.rstrip("/").split("/")
+            # /drive/v3/files, /drive/v3/files/<id>?alt=media, /drive/v3/files/<id>/export
+            if parts[-1] == "files":
+                return self._json(200, drive.list(params.get("q"), params.get("pageToken")))
+            if parts[-1] == "export":
+                body = drive.content(parts[-2], "export")
+            elif parts[-2] == "files" and params.get("alt") == "media":
+                body = drive.content(parts[-1], "media")
+            else:
+                body = None
+            if body is None:
+                return self._json(404, {"error": {"code": 404, "message": "File not found."}})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, status: int, payload: dict):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return DriveHandler
+
+# --- Fake OpenAI ---
+class FakeOpenAI:
+    """Answers the embeddings and chat completions endpoints after a configurable delay.
+
+    Embeddings are deterministic unit vectors derived from the input text, so the same text always
+    embeds the same way. Completions return `completion_tokens` filler words; when streamed, the
+    words are sent one per chunk, `token_latency` seconds apart.
+    """
+
+    def __init__(self, dimensions: int = 3072, embedding_latency: float = 0.05, embedding_latency_per_input: float = 0.0,
+                 completion_latency: float = 0.3, token_latency: float = 0.0, completion_tokens: int = 60):
+        self.dimensions = dimensions
+        self.embedding_latency = embedding_latency
+        self.embedding_latency_per_input = embedding_latency_per_input
+        self.completion_latency = completion_latency
+        self.token_latency = token_latency
+        self.completion_tokens = completion_tokens
+        self.requests = {"embeddings": 0, "embedding_inputs": 0, "completions": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _count_tokens(text: str) -> int:
+        # Close enough to tiktoken for usage reporting without depending on it.
+        return max(len(text) // 4, 1)
+
+    def _vector(self, text: str, dimensions: int) -> list:
+        rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+        vector = [rng.random() - 0.5 for _ in range(dimensions)]
+        norm = sum(value * value for value in vector) ** 0.5 or 1.0
+        return [value / norm for value in vector]
+
+    def embeddings(self, body: dict) -> dict:
+        inputs = body.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        self._count("embeddings", len(inputs))
+        time.sleep(self.embedding_latency + self.embedding_latency_per_input * len(inputs))
+        dimensions = body.get("dimensions") or self.dimensions
+        data = []
+        for index, text in enumerate(inputs):
+            vector = self._vector(text if isinstance(text, str) else json.dumps(text), dimensions)
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode("ascii")
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        tokens = sum(self._count_tokens(text if isinstance(text, str) else json.dumps(text)) for text in inputs)
+        return {
+            "object": "list", "data": data, "model": body.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def completion(self, body: dict):
+        """Returns the prompt token count and the answer as a list of token strings, after the delay."""
+        self._count("completions")
+        time.sleep(self.completion_latency)
+        prompt_tokens = sum(self._count_tokens(message.get("content") or "") for message in body.get("messages", []))
+        count = min(self.completion_tokens, body.get("max_tokens") or self.completion_tokens)
+        return prompt_tokens, [("This" if i == 0 else " answer") for i in range(count)]
+
+    def _count(self, kind: str, inputs: int = 0):
+        with self._lock:
+            self.requests[kind] += 1
+            if inputs:
+                self.requests["embedding_inputs"] += inputs
+
+def make_openai_handler(openai: FakeOpenAI):
+    class OpenAIHandler(BaseHTTPRequestHandler):
+        # Keep-alive, so client connection pooling behaves as it does against the real API.
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            path = urlparse(self.path).path.rstrip("/")
+            if path.endswith("/embeddings"):
+                return self._json(200, openai.embeddings(body))
+            if not path.endswith("/chat/completions"):
+                return self._json(404, {"error": {"message": f"Unknown endpoint {path}", "type": "invalid_request_error"}})
+            prompt_tokens, tokens = openai.completion(body)
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                     "total_tokens": prompt_tokens + len(tokens)}
+            base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": body.get("model")}
+            if not body.get("stream"):
+                return self._json(200, dict(base, object="chat.completion", usage=usage, choices=[{
+                    "index": 0, "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                }]))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            chunk = dict(base, object="chat.completion.chunk")
+            for i, token in enumerate(tokens):
+                if i and openai.token_latency:
+                    time.sleep(openai.token_latency)
+                delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+                self._event(dict(chunk, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+            self._event(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._event(dict(chunk, choices=[], usage=usage))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+        def _event(self, payload: dict):
+            self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _json(self, status: int, payload: dict):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("x-ratelimit-remaining-requests", "10000")
+            self.send_header("x-ratelimit-remaining-tokens", "10000000")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return OpenAIHandler
+
+# --- Fake Auth0 ---
+class FakeAuth0:
+    """Issues RS256 tokens and serves the matching JWKS, as an Auth0 tenant at `domain` would."""
+
+    def __init__(self, domain: str = "fake-auth0.local", audience: str = "chat-api", kid: str = "fake-signing-key"):
+        # Only needed here, and python-jose/cryptography are app dependencies anyway.
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from jose import jwk
+
+        self.domain = domain
+        self.audience = audience
+        self.kid = kid
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.private_pem = private_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode("ascii")
+        public_pem = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode("ascii")
+        public_jwk = jwk.construct(public_pem, algorithm="RS256").to_dict()
+        self._jwks = {"keys": [dict(public_jwk, kid=kid, use="sig")]}
+        self.requests = {"jwks": 0}
+
+    @property
+    def issuer(self) -> str:
+        return f"https://{self.domain}/"
+
+    def jwks(self) -> dict:
+        self.requests["jwks"] += 1
+        return self._jwks
+
+    def issue_token(self, subject: str = "fake-user", ttl: float = 3600, **claims) -> str:
+        from jose import jwt
+
+        now = int(time.time())
+        payload = {"iss": self.issuer, "aud": self.audience, "sub": subject, "iat": now, "exp": now + int(ttl), **claims}
+        return jwt.encode(payload, self.private_pem, algorithm="RS256", headers={"kid": self.kid})
+
+def make_auth0_handler(auth0: FakeAuth0):
+    class Auth0Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if urlparse(self.path).path != "/.well-known/jwks.json":
+                status, payload = 404, {"error": "not_found"}
+            else:
+                status, payload = 200, auth0.jwks()
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Auth0Handler
+
+# --- Server Helpers ---
+def start_server(handler, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Starts `handler` on a background thread; the bound port is server.server_address[1]."""
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake of an external service.")
+    subparsers = parser.add_subparsers(dest="service", required=True)
+    drive_parser = subparsers.add_parser("drive", help="Fake Google Drive v3 API")
+    drive_parser.add_argument("--root", required=True, help="Directory to serve as the Drive root folder")
+    drive_parser.add_argument("--page-size", type=int, default=100)
+    openai_parser = subparsers.add_parser("openai", help="Fake OpenAI embeddings and chat completions API")
+    openai_parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embeddings request")
+    openai_parser.add_argument("--completion-latency", type=float, default=0.3, help="Seconds before a completion starts")
+    openai_parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds between streamed tokens")
+    openai_parser.add_argument("--completion-tokens", type=int, default=60)
+    auth0_parser = subparsers.add_parser("auth0", help="Fake Auth0 JWKS endpoint and token issuer")
+    auth0_parser.add_argument("--domain", default="fake-auth0.local", help="Value to use as AUTH0_DOMAIN")
+    auth0_parser.add_argument("--audience", default="chat-api", help="Value to use as API_AUDIENCE")
+    auth0_parser.add_argument("--token-ttl", type=float, default=86400)
+    for sub, port in ((drive_parser, 8765), (openai_parser, 8766), (auth0_parser, 8767)):
+        sub.add_argument("--host", default="127.0.0.1")
+        sub.add_argument("--port", type=int, default=port)
+    args = parser.parse_args()
+
+    if args.service == "drive":
+        handler = make_drive_handler(FakeDrive(args.root, args.page_size))
+        print(f"Fake Drive serving {args.root} at http://{args.host}:{args.port}/drive/v3/")
+    elif args.service == "openai":
+        handler = make_openai_handler(FakeOpenAI(
+            embedding_latency=args.embedding_latency, completion_latency=args.completion_latency,
+            token_latency=args.token_latency, completion_tokens=args.completion_tokens
+        ))
+        print(f"Fake OpenAI API at http://{args.host}:{args.port}/v1")
+    else:
+        auth0 = FakeAuth0(args.domain, args.audience)
+        handler = make_auth0_handler(auth0)
+        print(f"Fake Auth0 JWKS at http://{args.host}:{args.port}/.well-known/jwks.json")
+        print(f"Bearer token: {auth0.issue_token(ttl=args.token_ttl)}")
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
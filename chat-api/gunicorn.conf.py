@@ -0,0 +1,31 @@
+"""gunicorn settings for the chat API; gunicorn loads this file from the working directory."""
+import glob
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+# Prometheus metrics are served here by the master, not on the API port Traefik publishes. 0 disables.
+metrics_port = int(os.getenv("METRICS_PORT", "9100"))
+# Chat workers no longer load Docling or the Drive client, so several fit where one used to.
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 120
+# Import the app once in the master; workers fork from it and share its memory copy-on-write.
+preload_app = True
+
+# Each worker is its own process, so Prometheus metrics are shared through files in this directory.
+# Set here, before the app (and prometheus_client) is imported.
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/chat-api-metrics")
+os.makedirs(metrics_dir, exist_ok=True)
+# Clear samples left by a previous run; only the metric files, as the directory may be the operator's.
+for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+    os.remove(path)
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+def when_ready(server):
+    if metrics_port:
+        from metrics import start_metrics_server
+        start_metrics_server(metrics_port)
+        server.log.info(f"Serving metrics on port {metrics_port}.")
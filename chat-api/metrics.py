@@ -0,0 +1,149 @@
+"""Prometheus metrics for the API and the ingestion worker, plus the optional Server-Timing header.
+
+Hot paths are timed with `stage_timer("<stage>")` (or the `timed` decorator). Each timing is
+observed in the chat_api_stage_duration_seconds histogram and, while an HTTP request is being
+served, also collected for that request so MetricsMiddleware can report it as Server-Timing.
+
+Metrics are served by `start_metrics_server` on a port of their own (see gunicorn.conf.py), not on
+the API port. With several gunicorn workers, set PROMETHEUS_MULTIPROC_DIR to a shared directory so
+the page aggregates every worker.
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, disable_created_metrics, multiprocess, start_http_server
+)
+
+# --- Metrics Configuration ---
+# Adds a Server-Timing header with the per-stage breakdown to every response (visible in browser devtools).
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+MULTIPROCESS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+disable_created_metrics()  # The *_created series only add noise to every scrape
+
+# Stages range from cache-hit lookups (~1ms) to completions and document conversion (tens of seconds).
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "chat_api_stage_duration_seconds", "Time spent in each stage of request handling and ingestion.",
+    ["stage"], buckets=STAGE_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "chat_api_http_request_duration_seconds", "HTTP request latency until the response headers are sent.",
+    ["method", "route", "status"], buckets=STAGE_BUCKETS
+)
+OPENAI_TOKENS = Counter(
+    "chat_api_openai_tokens_total", "Tokens billed by OpenAI, as reported in response usage.", ["model", "type"]
+)
+DB_POOL_IN_USE = Gauge(
+    "chat_api_db_pool_connections_in_use", "Database connections currently checked out of the pool.",
+    multiprocess_mode="livesum"
+)
+DB_POOL_MAX = Gauge(
+    "chat_api_db_pool_max_connections", "Size limit of the database connection pool.", multiprocess_mode="livesum"
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "chat_api_db_pool_wait_seconds", "Time spent waiting for a free database connection.", buckets=STAGE_BUCKETS
+)
+DB_POOL_TIMEOUTS = Counter(
+    "chat_api_db_pool_timeouts_total", "Requests that gave up waiting for a database connection."
+)
+
+# Stage timings of the request being served; None outside of a request (e.g. in the worker).
+_request_stages: ContextVar[Optional[list]] = ContextVar("request_stages", default=None)
+
+# --- Recording ---
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((stage, seconds))
+
+@contextmanager
+def stage_timer(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+def timed(stage: str):
+    """Decorator form of stage_timer for synchronous functions."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_tokens(model: str, prompt: int = 0, completion: int = 0, embedding: int = 0):
+    for token_type, count in (("prompt", prompt), ("completion", completion), ("embedding", embedding)):
+        if count:
+            OPENAI_TOKENS.labels(model, token_type).inc(count)
+
+# --- Exposition ---
+def start_metrics_server(port: int):
+    """Serves the metrics page on `port` from a background thread (gunicorn's master, or the worker)."""
+    if MULTIPROCESS_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(port, registry=registry)
+    else:
+        start_http_server(port, registry=REGISTRY)
+
+def server_timing_header(stages: list, total: float) -> str:
+    # Stages that ran more than once in the request (e.g. two embeddings) are summed.
+    durations = {}
+    for stage, seconds in stages:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    durations["total"] = total
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in durations.items())
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request and, if enabled, adding the Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        stages = []
+        token = _request_stages.set(stages)
+
+        response_started = False
+
+        def observe(status: int) -> float:
+            elapsed = time.perf_counter() - started
+            # The router stores the matched route in the scope; label by its template, not the raw path.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(elapsed)
+            return elapsed
+
+        async def send_with_metrics(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+                elapsed = observe(message["status"])
+                if SERVER_TIMING_ENABLED:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing_header(stages, elapsed).encode("latin-1")))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        except Exception:
+            # Unhandled errors are answered by Starlette's outermost middleware, past this one.
+            if not response_started:
+                observe(500)
+            raise
+        finally:
+            _request_stages.reset(token)
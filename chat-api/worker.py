@@ -0,0 +1,195 @@
+import os
+import logging
+import select
+import socket
+import threading
+from typing import List, Optional
+
+import psycopg2
+from psycopg2.extras import execute_values, Json
+
+from app import (
+    ANN_MODE, DB_PARAMS, INGEST_JOB_CHANNEL, SEARCH_MODE, close_db_pool, ensure_ann_index, ensure_text_search_index,
+    get_db_connection, init_db_pool, process_documents, setup_postgres, shutdown_converter_pool, warm_converter_pool
+)
+from metrics import start_metrics_server
+
+logger = logging.getLogger("worker")
+
+# --- Worker Configuration ---
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "30"))  # Seconds between polls when no NOTIFY arrives
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "15"))
+# A running job whose heartbeat is older than this belongs to a dead worker and is requeued.
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+# Ingestion stage timings and token counts are recorded in this process, so it serves its own /metrics.
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9101"))  # 0 disables
+
+# --- Job Queue ---
+def requeue_stale_jobs():
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE ingest_jobs
+                SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'queued' END,
+                    error = CASE WHEN attempts >= %s THEN 'Worker stopped responding too many times.' ELSE error END,
+                    finished_at = CASE WHEN attempts >= %s THEN now() ELSE NULL END
+                WHERE status = 'running' AND heartbeat_at < now() - make_interval(secs => %s)
+                RETURNING id, status
+            """, (JOB_MAX_ATTEMPTS, JOB_MAX_ATTEMPTS, JOB_MAX_ATTEMPTS, JOB_STALE_AFTER))
+            for job_id, status in cursor.fetchall():
+                logger.warning(f"Job {job_id} lost its worker; marked {status}.")
+        conn.commit()
+
+def claim_job() -> Optional[tuple]:
+    # SKIP LOCKED lets several workers poll the same table without handing out a job twice.
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE ingest_jobs
+                SET status = 'running', attempts = attempts + 1, worker = %s,
+                    started_at = now(), heartbeat_at = now()
+                WHERE id = (
+                    SELECT id FROM ingest_jobs WHERE status = 'queued'
+                    ORDER BY id FOR UPDATE SKIP LOCKED LIMIT 1
+                )
+                RETURNING id, request
+            """, (WORKER_ID,))
+            job = cursor.fetchone()
+        conn.commit()
+    return job
+
+def finish_job(job_id: int, status: str, summary: Optional[dict] = None, error: Optional[str] = None):
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE ingest_jobs SET status = %s, summary = %s, error = %s, finished_at = now(), heartbeat_at = now()
+                WHERE id = %s
+            """, (status, Json(summary) if summary is not None else None, error, job_id))
+        conn.commit()
+
+class JobProgress:
+    """process_documents progress callback that records per-file status in ingest_job_files."""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+
+    def __call__(self, updates: List[dict]):
+        if not updates:
+            return
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    execute_values(cursor, """
+                        INSERT INTO ingest_job_files (job_id, doc_id, doc_name, status, chunks, embedded, seconds, timings, error)
+                        VALUES %s
+                        ON CONFLICT (job_id, doc_id) DO UPDATE SET
+                            doc_name = EXCLUDED.doc_name,
+                            status = EXCLUDED.status,
+                            chunks = EXCLUDED.chunks,
+                            embedded = EXCLUDED.embedded,
+                            seconds = EXCLUDED.seconds,
+                            timings = EXCLUDED.timings,
+                            error = EXCLUDED.error,
+                            updated_at = now()
+                    """, [
+                        (self.job_id, u["doc_id"], u.get("doc_name"), u["status"], u.get("chunks"), u.get("embedded"),
+                         u.get("seconds"), Json(u["timings"]) if u.get("timings") else None, u.get("error"))
+                        for u in updates
+                    ])
+                conn.commit()
+        except psycopg2.Error as e:
+            # Progress is informational; never fail the ingestion because of it.
+            logger.warning(f"Could not record progress for job {self.job_id}: {e}")
+
+def heartbeat(job_id: int, stop: threading.Event):
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("UPDATE ingest_jobs SET heartbeat_at = now() WHERE id = %s", (job_id,))
+                conn.commit()
+        except psycopg2.Error as e:
+            logger.warning(f"Heartbeat for job {job_id} failed: {e}")
+
+def run_job(job_id: int, request: dict):
+    logger.info(f"Running ingestion job {job_id}: {request}")
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(job_id, stop), daemon=True)
+    beat.start()
+    try:
+        summary = process_documents(
+            source_type=request["source_type"],
+            google_drive_folder_id=request.get("google_drive_folder_id"),
+            local_folder_path=request.get("local_folder_path"),
+            progress=JobProgress(job_id)
+        )
+        finish_job(job_id, "succeeded", summary=summary)
+        logger.info(f"Ingestion job {job_id} finished: {summary}")
+    except Exception as e:
+        logger.error(f"Ingestion job {job_id} failed: {e}", exc_info=True)
+        finish_job(job_id, "failed", error=str(e))
+    finally:
+        stop.set()
+        beat.join()
+
+def listen_connection():
+    conn = psycopg2.connect(**DB_PARAMS)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f"LISTEN {INGEST_JOB_CHANNEL}")
+    return conn
+
+def wait_for_jobs(conn, timeout: float):
+    if select.select([conn], [], [], timeout) != ([], [], []):
+        conn.poll()
+        conn.notifies.clear()
+
+def build_search_indexes():
+    builds = []
+    if SEARCH_MODE == "hybrid":
+        builds.append(("full-text", ensure_text_search_index))
+    if ANN_MODE != "exact":
+        builds.append(("ANN", ensure_ann_index))
+    for name, build in builds:
+        try:
+            build()
+        except Exception as e:
+            logger.error(f"Could not build the {name} index: {e}", exc_info=True)
+
+def main():
+    logger.info(f"Ingestion worker {WORKER_ID} starting...")
+    if WORKER_METRICS_PORT:
+        start_metrics_server(WORKER_METRICS_PORT)
+        logger.info(f"Serving worker metrics on port {WORKER_METRICS_PORT}.")
+    init_db_pool()
+    setup_postgres()
+    # The API never builds search indexes. Build them here, off the job loop: a large HNSW build takes a while.
+    threading.Thread(target=build_search_indexes, name="search-indexes", daemon=True).start()
+    # Load the Docling models up front, so a job arriving soon after startup finds them ready.
+    # They are released after INGEST_CONVERT_IDLE_TIMEOUT seconds without a job.
+    try:
+        warm_converter_pool()
+    except Exception as e:
+        logger.error(f"Could not start conversion processes: {e}", exc_info=True)
+    listener = listen_connection()
+    try:
+        while True:
+            requeue_stale_jobs()
+            job = claim_job()
+            if job:
+                run_job(*job)
+                continue
+            try:
+                wait_for_jobs(listener, JOB_POLL_INTERVAL)
+            except psycopg2.Error as e:
+                logger.warning(f"Lost LISTEN connection ({e}); reconnecting.")
+                listener = listen_connection()
+    finally:
+        listener.close()
+        shutdown_converter_pool()
+        close_db_pool()
+
+if __name__ == "__main__":
+    main()